@@ -0,0 +1,162 @@
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+# Runs from a checkout, without installing obsitex
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from obsitex.cache import CacheManager, use_cache_manager
+from obsitex.constants import MAX_FORMATTED_LINE_LENGTH
+from obsitex.parser.formatting import format_text
+
+# Pieces that open inline formatting without closing it, or close it without
+# opening it, which made the old patterns backtrack
+ADVERSARIAL_PIECES = [
+    "[",
+    "]",
+    "[[",
+    "]]",
+    "[[@key]]",
+    ", ",
+    "$",
+    "`",
+    "*",
+    "**",
+    "==",
+    '*"',
+    " ^",
+    "a",
+    " ",
+]
+
+# Lines of n characters, built from a repeated piece
+ADVERSARIAL_LINES: Dict[str, Callable[[int], str]] = {
+    "unclosed square brackets": lambda n: "[a " * (n // 3),
+    "unclosed links": lambda n: "[[a " * (n // 4),
+    "closing links": lambda n: "a]] " * (n // 4),
+    "citation separators": lambda n: "[[@key]]" + ", " * ((n - 8) // 2),
+    "adjacent citations": lambda n: "[[@key]], " * (n // 10),
+    "unclosed citations": lambda n: "[[@key, " * (n // 8),
+    "unclosed equations": lambda n: "$a " * (n // 3),
+    "unclosed code": lambda n: "`a " * (n // 3),
+    "unclosed italics": lambda n: "*a " * (n // 3),
+    "unclosed bold": lambda n: "**a " * (n // 4),
+    "unclosed highlights": lambda n: "==a " * (n // 4),
+    "unclosed text quotes": lambda n: '*"a ' * (n // 4),
+    "brackets then closing": lambda n: "[" * (n // 2) + "]" * (n // 2),
+    "block ids": lambda n: (" ^a-b" * (n // 5))[: n - 1] + ".",
+}
+
+
+def time_line(line: str) -> float:
+    # Formatted without caching, so every run formats the line again
+    with use_cache_manager(CacheManager(enabled=False)):
+        start = time.perf_counter()
+        format_text([line])
+        return time.perf_counter() - start
+
+
+def fuzz_lines(n_lines: int, length: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    lines = []
+
+    for _ in range(n_lines):
+        pieces, n_chars = [], 0
+
+        while n_chars < length:
+            piece = rng.choice(ADVERSARIAL_PIECES)
+            pieces.append(piece)
+            n_chars += len(piece)
+
+        lines.append("".join(pieces)[:length])
+
+    return lines
+
+
+def run_benchmark(
+    length: int, bound: float, max_growth: float, fuzz_cases: int, seed: int
+) -> List[str]:
+    # Returns the cases that exceeded their bound, each line must format in
+    # under the bound, and 4 times longer lines in under max_growth times
+    # longer, e.g.: quadratic patterns take 16 times longer
+    failures = []
+    cases: List[Tuple[str, str, str]] = [
+        (name, build_line(length // 4), build_line(length))
+        for name, build_line in ADVERSARIAL_LINES.items()
+    ]
+    cases += [
+        (f"fuzz {index}", short_line, long_line)
+        for index, (short_line, long_line) in enumerate(
+            zip(
+                fuzz_lines(fuzz_cases, length // 4, seed),
+                fuzz_lines(fuzz_cases, length, seed),
+            )
+        )
+    ]
+
+    for name, short_line, long_line in cases:
+        short_time, long_time = time_line(short_line), time_line(long_line)
+        growth = long_time / max(short_time, 1e-3)
+        print(f"{name:<28} {short_time * 1e3:8.2f}ms {long_time * 1e3:8.2f}ms")
+
+        if long_time > bound:
+            failures.append(f"{name} took {long_time:.2f}s, over {bound}s")
+        elif growth > max_growth:
+            failures.append(f"{name} grew {growth:.1f} times, over {max_growth}")
+
+    # Lines over the limit are rejected with a clear error, before formatting
+    try:
+        format_text(["a" * (MAX_FORMATTED_LINE_LENGTH + 1)])
+        failures.append("line over the limit wasn't rejected")
+    except ValueError:
+        pass
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Times inline formatting on adversarial lines, exits with an error if any is over its bound."
+    )
+    parser.add_argument(
+        "--length",
+        type=int,
+        default=MAX_FORMATTED_LINE_LENGTH,
+        help="Characters of the longest lines, shorter lines are a quarter of it.",
+    )
+    parser.add_argument(
+        "--bound",
+        type=float,
+        default=1.0,
+        help="Seconds each of the longest lines must format in.",
+    )
+    parser.add_argument(
+        "--max-growth",
+        type=float,
+        default=10.0,
+        help="How many times longer 4 times longer lines may take to format.",
+    )
+    parser.add_argument(
+        "--fuzz-cases",
+        type=int,
+        default=32,
+        help="Random lines of adversarial pieces to time.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    failures = run_benchmark(
+        args.length, args.bound, args.max_growth, args.fuzz_cases, args.seed
+    )
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+
+    return 1 if len(failures) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
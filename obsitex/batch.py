@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import yaml
+
+from obsitex.conversion import convert_input
+from obsitex.manifest import Manifest
+
+JOURNAL_VERSION = 1
+
+# Status of each attempt recorded in the journal
+DOCUMENT_DONE = "done"
+DOCUMENT_FAILED = "failed"
+
+# Status of documents whose recorded conversion is still up to date
+DOCUMENT_SKIPPED = "skipped"
+
+# I/O errors that fail the same way on every attempt, so aren't retried
+NON_TRANSIENT_OS_ERRORS = (
+    FileNotFoundError,
+    IsADirectoryError,
+    NotADirectoryError,
+    PermissionError,
+)
+
+# Settings of each document in a batch file, paths are relative to the file
+DOCUMENT_PATH_SETTINGS = (
+    "input",
+    "main-tex",
+    "bibtex",
+    "main-bibtex",
+    "graphics",
+    "data",
+    "template",
+)
+
+
+class BatchDocument:
+    # One document of a batch, converted as with the options of the CLI
+    def __init__(self, name: str, settings: Dict[str, Optional[Path]]):
+        self.name = name
+        self.settings = settings
+
+    @property
+    def input_path(self) -> Path:
+        return self.settings["input"]
+
+    @property
+    def main_tex(self) -> Path:
+        return self.settings["main-tex"]
+
+    def journal_settings(self) -> Dict[str, Optional[str]]:
+        # Changing any setting, e.g.: the template, converts the document again
+        return {
+            key: str(Path(value).resolve()) if value is not None else None
+            for key, value in sorted(self.settings.items())
+        }
+
+    def __repr__(self):
+        return f"BatchDocument({self.name})"
+
+
+def load_batch(batch_path: Path) -> List[BatchDocument]:
+    # Documents are a YAML list, named after their main-tex if not given, e.g.:
+    # - name: thesis
+    #   input: Thesis
+    #   main-tex: output/thesis.tex
+    #   bibtex: references.bib
+    #   main-bibtex: output/thesis.bib
+    with open(batch_path, "r") as file:
+        batch_config = yaml.safe_load(file)
+
+    if not isinstance(batch_config, list) or len(batch_config) == 0:
+        raise ValueError(f"Documents in {batch_path} must be a non empty list.")
+
+    base_path = batch_path.parent
+    documents, names = [], set()
+
+    for document_config in batch_config:
+        if (
+            not isinstance(document_config, dict)
+            or "input" not in document_config
+            or "main-tex" not in document_config
+        ):
+            raise ValueError(
+                f"Each document in {batch_path} must define its input and main-tex, got {document_config}"
+            )
+
+        unknown_settings = set(document_config) - set(DOCUMENT_PATH_SETTINGS) - {"name"}
+
+        if len(unknown_settings) > 0:
+            raise ValueError(
+                f"Unknown settings {sorted(unknown_settings)} in {batch_path}, expected {DOCUMENT_PATH_SETTINGS}."
+            )
+
+        name = str(document_config.get("name", document_config["main-tex"]))
+
+        if name in names:
+            raise ValueError(f"Document {name} is defined twice in {batch_path}.")
+
+        names.add(name)
+        settings = {
+            key: (
+                base_path / document_config[key]
+                if document_config.get(key, None) is not None
+                else None
+            )
+            for key in DOCUMENT_PATH_SETTINGS
+        }
+        documents.append(BatchDocument(name, settings))
+
+    return documents
+
+
+class CheckpointJournal:
+    # Append-only JSON lines, one per attempt, flushed to disk before the next
+    # document starts, so that an interrupted batch resumes where it stopped
+    def __init__(self, path: Path):
+        self.path = path
+
+    def load(self) -> Dict[str, dict]:
+        # Latest record of each document, later records win
+        records = {}
+
+        if not self.path.is_file():
+            return records
+
+        with open(self.path, "r") as file:
+            for line_index, line in enumerate(file):
+                if line.strip() == "":
+                    continue
+
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Interrupted while appending, the attempt is retried
+                    logging.warning(
+                        f"Ignoring truncated record in line {line_index + 1} of {self.path}."
+                    )
+                    continue
+
+                if record.get("version") != JOURNAL_VERSION:
+                    raise ValueError(
+                        f"Unsupported journal version {record.get('version')} in {self.path}."
+                    )
+
+                records[record["document"]] = record
+
+        return records
+
+    def append(self, record: dict):
+        record = dict(record, version=JOURNAL_VERSION, time=time.time())
+        line = json.dumps(record) + "\n"
+
+        # Records start in a new line, even after a truncated record
+        if self.path.is_file() and self.path.stat().st_size > 0:
+            with open(self.path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+
+                if file.read(1) != b"\n":
+                    line = "\n" + line
+
+        with open(self.path, "a") as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def is_up_to_date(document: BatchDocument, record: Optional[dict]) -> bool:
+    # Outputs are skipped if their last conversion succeeded with the same
+    # settings, they still exist and the hashes of all inputs still match
+    if (
+        record is None
+        or record["status"] != DOCUMENT_DONE
+        or record["settings"] != document.journal_settings()
+    ):
+        return False
+
+    manifest = Manifest()
+    manifest.outputs = record["manifest"]["outputs"]
+    manifest.inputs = record["manifest"]["inputs"]
+
+    return not manifest.is_stale()
+
+
+def convert_document(document: BatchDocument) -> Manifest:
+    settings = document.settings
+    conversion = convert_input(
+        document.input_path,
+        main_tex=document.main_tex,
+        template_path=settings["template"],
+        graphics_folder=settings["graphics"],
+        data_folder=settings["data"],
+        bibtex_database_path=settings["bibtex"],
+        out_bitex_path=settings["main-bibtex"],
+    )
+
+    return conversion.build_manifest()
+
+
+def is_transient(error: Exception) -> bool:
+    # Only I/O errors may succeed on a retry, e.g.: a network share that is
+    # briefly unavailable, parse errors and missing files fail the same way
+    return isinstance(error, OSError) and not isinstance(error, NON_TRANSIENT_OS_ERRORS)
+
+
+def run_batch(
+    documents: List[BatchDocument],
+    journal: CheckpointJournal,
+    retries: int = 2,
+    backoff: float = 1.0,
+    convert: Callable[[BatchDocument], Manifest] = convert_document,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Dict[str, str]:
+    # Returns the status of each document, e.g.: done, skipped or failed,
+    # documents failing with transient I/O errors are retried with exponential
+    # backoff, and all failed documents again when the batch is restarted
+    records = journal.load()
+    statuses = {}
+
+    for document in documents:
+        if is_up_to_date(document, records.get(document.name, None)):
+            logging.info(f"Skipping {document.name}, its inputs didn't change.")
+            statuses[document.name] = DOCUMENT_SKIPPED
+            continue
+
+        for attempt in range(retries + 1):
+            record = {
+                "document": document.name,
+                "attempt": attempt + 1,
+                "settings": document.journal_settings(),
+            }
+
+            try:
+                manifest = convert(document)
+            except Exception as error:
+                logging.error(
+                    f"Attempt {attempt + 1} of {document.name} failed: {error}"
+                )
+                journal.append(dict(record, status=DOCUMENT_FAILED, error=repr(error)))
+                statuses[document.name] = DOCUMENT_FAILED
+
+                if attempt == retries or not is_transient(error):
+                    break
+
+                sleep(backoff * 2**attempt)
+            else:
+                journal.append(
+                    dict(record, status=DOCUMENT_DONE, manifest=manifest.to_dict())
+                )
+                statuses[document.name] = DOCUMENT_DONE
+                break
+
+    return statuses
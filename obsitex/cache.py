@@ -0,0 +1,263 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Set, Tuple
+
+# Limits of the caches used by obsitex, by namespace, None means no limit, all
+# of them together hold at most 16MB, since the default cache manager is shared
+# by every parser in the process
+DEFAULT_CACHE_LIMITS = {
+    "notes": {"max_entries": None, "max_bytes": 4 << 20},
+    "note indices": {"max_entries": 64, "max_bytes": 4 << 20},
+    "frontmatter": {"max_entries": 1024, "max_bytes": 512 << 10},
+    "callout configs": {"max_entries": 1024, "max_bytes": 512 << 10},
+    "formatted lines": {"max_entries": None, "max_bytes": 2 << 20},
+    "templates": {"max_entries": 32, "max_bytes": 1 << 20},
+    "external tables": {"max_entries": 4, "max_bytes": 4 << 20},
+}
+
+# Used by namespaces without limits of their own
+DEFAULT_NAMESPACE_LIMITS = {"max_entries": 1024, "max_bytes": 1 << 20}
+
+# Returned by lookups that miss, since None might be a cached value
+MISSING = object()
+
+
+def sizeof(value: Any) -> int:
+    # Approximate size of a value, text is measured by its length
+    if isinstance(value, (str, bytes)):
+        return len(value)
+
+    return sys.getsizeof(value)
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Entries dropped because the file they were read from changed
+        self.invalidations = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def __repr__(self):
+        return f"CacheStats(hits={self.hits}, misses={self.misses}, evictions={self.evictions}, invalidations={self.invalidations})"
+
+
+class LRUCache:
+    # Least recently used entries are evicted first, once there are more
+    # entries or bytes than the limits allow
+    def __init__(
+        self,
+        name: str,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self.n_bytes = 0
+
+        # Entries as (value, size, path, mtime), path and mtime are only set
+        # for entries read from a file
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, Optional[str], Any]]" = (
+            OrderedDict()
+        )
+        self._keys_by_path: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, mtime: Any = None) -> Any:
+        # Entries read from a file are only valid for the same mtime
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+
+            if entry is not MISSING and entry[2] is not None and entry[3] != mtime:
+                self._remove(key)
+                self.stats.invalidations += 1
+                entry = MISSING
+
+            if entry is MISSING:
+                self.stats.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def put(
+        self,
+        key: Hashable,
+        value: Any,
+        size: Optional[int] = None,
+        path: Optional[Path] = None,
+        mtime: Any = None,
+    ):
+        if size is None:
+            size = sizeof(value)
+
+        if path is not None:
+            path = os.path.abspath(path)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            # Values that don't fit aren't cached, instead of clearing the cache
+            if self.max_entries == 0 or (
+                self.max_bytes is not None and size > self.max_bytes
+            ):
+                return
+
+            self._entries[key] = (value, size, path, mtime)
+            self.n_bytes += size
+
+            if path is not None:
+                self._keys_by_path.setdefault(path, set()).add(key)
+
+            while (
+                self.max_entries is not None and len(self._entries) > self.max_entries
+            ) or (self.max_bytes is not None and self.n_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def get_or_compute(
+        self,
+        key: Hashable,
+        compute: Callable[[], Any],
+        size: Optional[Callable[[Any], int]] = None,
+        path: Optional[Path] = None,
+        mtime: Any = None,
+    ) -> Any:
+        value = self.get(key, mtime)
+
+        if value is MISSING:
+            value = compute()
+            self.put(key, value, size(value) if size is not None else None, path, mtime)
+
+        return value
+
+    def _remove(self, key: Hashable):
+        _, size, path, _ = self._entries.pop(key)
+        self.n_bytes -= size
+
+        if path is not None:
+            keys = self._keys_by_path[path]
+            keys.discard(key)
+
+            if len(keys) == 0:
+                del self._keys_by_path[path]
+
+    def invalidate_path(self, path: Path) -> int:
+        with self._lock:
+            keys = list(self._keys_by_path.get(os.path.abspath(path), ()))
+
+            for key in keys:
+                self._remove(key)
+
+            self.stats.invalidations += len(keys)
+
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self.n_bytes = 0
+
+    def __repr__(self):
+        return f'LRUCache(name="{self.name}", entries={len(self._entries)}, bytes={self.n_bytes})'
+
+
+class CacheManager:
+    # Caches of obsitex by namespace, e.g.: notes, formatted lines, templates,
+    # each with its own limits, so that memory stays bounded in long runs
+    def __init__(self, limits: Optional[Dict[str, dict]] = None, enabled: bool = True):
+        self.enabled = enabled
+        self.limits = {
+            name: dict(limit) for name, limit in DEFAULT_CACHE_LIMITS.items()
+        }
+
+        for name, limit in (limits or {}).items():
+            self.limits[name] = dict(
+                self.limits.get(name, DEFAULT_NAMESPACE_LIMITS), **limit
+            )
+
+        self._namespaces: Dict[str, LRUCache] = {}
+        self._lock = threading.Lock()
+
+    def namespace(self, name: str) -> LRUCache:
+        with self._lock:
+            if name not in self._namespaces:
+                limit = self.limits.get(name, DEFAULT_NAMESPACE_LIMITS)
+
+                # Disabled caches still count the lookups, but keep nothing
+                self._namespaces[name] = LRUCache(
+                    name,
+                    max_entries=limit.get("max_entries") if self.enabled else 0,
+                    max_bytes=limit.get("max_bytes"),
+                )
+
+            return self._namespaces[name]
+
+    def invalidate_path(self, path: Path) -> int:
+        with self._lock:
+            namespaces = list(self._namespaces.values())
+
+        return sum(namespace.invalidate_path(path) for namespace in namespaces)
+
+    def clear(self):
+        with self._lock:
+            namespaces = list(self._namespaces.values())
+
+        for namespace in namespaces:
+            namespace.clear()
+
+    def stats(self) -> Dict[str, CacheStats]:
+        with self._lock:
+            return {name: cache.stats for name, cache in self._namespaces.items()}
+
+    @property
+    def n_bytes(self) -> int:
+        with self._lock:
+            return sum(cache.n_bytes for cache in self._namespaces.values())
+
+    def __repr__(self):
+        return (
+            f"CacheManager(namespaces={sorted(self._namespaces)}, bytes={self.n_bytes})"
+        )
+
+
+# Used when no cache manager is given, shared by all conversions in the process
+DEFAULT_CACHE_MANAGER = CacheManager()
+
+_CURRENT_CACHE_MANAGER: ContextVar[CacheManager] = ContextVar(
+    "obsitex_cache_manager", default=DEFAULT_CACHE_MANAGER
+)
+
+
+def current_cache_manager() -> CacheManager:
+    # Used by functions without access to the parser, e.g.: format_text
+    return _CURRENT_CACHE_MANAGER.get()
+
+
+@contextmanager
+def use_cache_manager(cache_manager: CacheManager) -> Iterator[CacheManager]:
+    token = _CURRENT_CACHE_MANAGER.set(cache_manager)
+
+    try:
+        yield cache_manager
+    finally:
+        _CURRENT_CACHE_MANAGER.reset(token)
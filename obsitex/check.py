@@ -0,0 +1,113 @@
+import re
+from pathlib import Path
+from typing import List, Optional, Set
+
+from obsitex.cache import LRUCache, use_cache_manager
+from obsitex.constants import MAX_SCANNED_NOTES_BYTES
+from obsitex.filesystem import FileSystem
+from obsitex.parser import ObsidianParser
+from obsitex.parser.formatting import iter_citations
+from obsitex.planner import ExecutionPlan
+from obsitex.planner.jobs import AddText, LoadText
+from obsitex.problems import Problem
+
+# Keys of the entries in a BibTeX database, found without parsing the entries
+BIBTEX_KEY_REGEX = re.compile(
+    r"^[ \t]*@(?!comment|string|preamble)\w+[ \t]*[{(][ \t]*([^,\s]+)[ \t]*,",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def find_bibtex_keys(text: str) -> Set[str]:
+    return set(BIBTEX_KEY_REGEX.findall(text))
+
+
+def check_citations(
+    plan: ExecutionPlan,
+    bibtex_database_path: Optional[Path],
+    filesystem: FileSystem,
+    problems: List[Problem],
+):
+    if len(plan.citation_keys) == 0:
+        return
+
+    if bibtex_database_path is None:
+        problems.append(
+            Problem(None, None, "Citations are used, but no BibTeX database was given.")
+        )
+        return
+
+    if not filesystem.is_file(bibtex_database_path):
+        problems.append(
+            Problem(bibtex_database_path, None, "BibTeX database not found.")
+        )
+        return
+
+    bib_keys = find_bibtex_keys(filesystem.read_text(bibtex_database_path))
+
+    # Every use of a missing key is reported, with its line
+    scanned_notes = LRUCache("scanned notes", max_bytes=MAX_SCANNED_NOTES_BYTES)
+
+    for job in plan.iter_jobs():
+        if isinstance(job, AddText):
+            text = job.text
+        elif isinstance(job, LoadText):
+            text = plan.load_text(job, scanned_notes)
+        else:
+            continue
+
+        line, line_offset = job.first_line, 0
+
+        for start, _, key in iter_citations(text):
+            line += text.count("\n", line_offset, start)
+            line_offset = start
+
+            if key not in bib_keys:
+                problems.append(
+                    Problem(job.source_path, line, f"Citation key {key} not found.")
+                )
+
+
+def check_vault(
+    input_path: Path,
+    parser: Optional[ObsidianParser] = None,
+    bibtex_database_path: Optional[Path] = None,
+) -> List[Problem]:
+    # Plans the notes and detects their blocks, collecting all problems that
+    # would make the conversion fail, without formatting nor rendering
+    if parser is None:
+        parser = ObsidianParser()
+
+    if bibtex_database_path is None:
+        bibtex_database_path = parser.execution_plan.bibtex_database_path
+
+    plan = ExecutionPlan(
+        implictly_add_bibtex=False,
+        hooks=parser.hooks,
+        filesystem=parser.filesystem,
+        collect_problems=True,
+        lazy=parser.execution_plan.lazy,
+        cache_manager=parser.cache_manager,
+    )
+    problems = plan.problems
+
+    if parser.filesystem.is_dir(input_path):
+        plan.add_dir(input_path)
+    elif parser.filesystem.is_file(input_path):
+        plan.add_file(input_path)
+        plan.initial_hlevel = parser.base_hlevel - 1
+    else:
+        return [Problem(input_path, None, "Input path does not exist.")]
+
+    context = parser.new_context(plan)
+    context.problems = problems
+
+    with use_cache_manager(parser.cache_manager):
+        for block in parser.iter_blocks(context):
+            for message in block.validate(**parser.extra_args):
+                line = block.line_range[0] if block.line_range is not None else None
+                problems.append(Problem(block.source_path, line, message))
+
+    check_citations(plan, bibtex_database_path, parser.filesystem, problems)
+
+    return problems
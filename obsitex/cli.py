@@ -1,12 +1,181 @@
 import argparse
 import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Optional, Sequence
 
 from obsitex import ObsidianParser
-from obsitex.constants import DEFAULT_JINJA2_MAIN_TEMPLATE
+from obsitex.batch import DOCUMENT_FAILED, CheckpointJournal, load_batch, run_batch
+from obsitex.cache import DEFAULT_CACHE_MANAGER
+from obsitex.check import check_vault
+from obsitex.conversion import convert_input
+from obsitex.events import ChromeTraceSink, EventHooks
+from obsitex.filesystem import LOCAL_FILESYSTEM, open_archive
+from obsitex.manifest import Manifest, find_stale_outputs
+from obsitex.metrics import METRICS_REGISTRY, MetricsSink
+from obsitex.parser.tikz import DEFAULT_TIKZ_COMMAND, TikZCompiler
+from obsitex.targets import load_targets
 
 
-def main():
+def stale(argv: Sequence[str]):
+    parser = argparse.ArgumentParser(
+        prog="obsitex stale",
+        description="List the outputs affected by changes to their inputs",
+    )
+    parser.add_argument(
+        "manifests",
+        type=Path,
+        nargs="+",
+        help="Paths to the manifests written by previous conversions.",
+    )
+    parser.add_argument(
+        "--changed",
+        "-c",
+        type=Path,
+        nargs="+",
+        help="Paths to the changed files, if not provided the hashes of all inputs are compared.",
+    )
+
+    args = parser.parse_args(argv)
+    manifests = [Manifest.load(manifest_path) for manifest_path in args.manifests]
+
+    for output_path in find_stale_outputs(manifests, args.changed):
+        print(output_path)
+
+
+def check(argv: Sequence[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="obsitex check",
+        description="Find problems in Obsidian notes without converting them",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        type=Path,
+        help="Path to the input file or folder containing the Obsidian notes.",
+        required=True,
+    )
+    parser.add_argument(
+        "--archive",
+        "-a",
+        type=Path,
+        help="Path to a zip or tar archive of the vault, the other paths are then relative to the archive root.",
+    )
+    parser.add_argument(
+        "--bibtex",
+        "-b",
+        type=Path,
+        help="Path to the BibTeX database file with all references.",
+    )
+    parser.add_argument(
+        "--graphics",
+        "-g",
+        type=Path,
+        help="Path to the graphics folder, where all images are assumed to be stored.",
+    )
+    parser.add_argument(
+        "--data",
+        "-dt",
+        type=Path,
+        help="Path to the folder with the CSV/TSV files of external tables.",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.archive is not None:
+        filesystem = open_archive(args.archive)
+    else:
+        filesystem = LOCAL_FILESYSTEM
+
+    problems = check_vault(
+        args.input,
+        ObsidianParser(
+            graphics_folder=args.graphics,
+            data_folder=args.data,
+            filesystem=filesystem,
+        ),
+        bibtex_database_path=args.bibtex,
+    )
+
+    for problem in problems:
+        print(problem)
+
+    # Non zero exit code if there are problems, e.g.: for pre-commit hooks
+    return 1 if len(problems) > 0 else 0
+
+
+def batch(argv: Sequence[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="obsitex batch",
+        description="Convert many documents, resuming from a checkpoint journal if interrupted",
+    )
+    parser.add_argument(
+        "documents",
+        type=Path,
+        help="Path to a YAML list of documents, each with its input, main-tex, bibtex, main-bibtex, graphics, data and template.",
+    )
+    parser.add_argument(
+        "--journal",
+        "-j",
+        type=Path,
+        help="Path to the append-only checkpoint journal, defaults to the documents file with a .journal.jsonl suffix.",
+    )
+    parser.add_argument(
+        "--retries",
+        "-r",
+        type=int,
+        default=2,
+        help="Number of times a document failing with an I/O error is retried before moving on.",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=1.0,
+        help="Seconds to wait before the first retry, doubled on each retry.",
+    )
+    parser.add_argument(
+        "--debug",
+        "-d",
+        action="store_true",
+        help="Enable debug mode, which will print additional information by enabling logging.",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    if args.journal is None:
+        args.journal = args.documents.with_suffix(".journal.jsonl")
+
+    statuses = run_batch(
+        load_batch(args.documents),
+        CheckpointJournal(args.journal),
+        retries=args.retries,
+        backoff=args.backoff,
+    )
+
+    for name, status in statuses.items():
+        print(f"{name}: {status}")
+
+    # Non zero exit code if any document failed, which is retried on rerun
+    return 1 if DOCUMENT_FAILED in statuses.values() else 0
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if len(argv) > 0 and argv[0] == "stale":
+        return stale(argv[1:])
+
+    if len(argv) > 0 and argv[0] == "check":
+        return check(argv[1:])
+
+    if len(argv) > 0 and argv[0] == "batch":
+        return batch(argv[1:])
+
     parser = argparse.ArgumentParser(description="Convert Obsidian notes to LaTeX")
 
     # Defines the inputs
@@ -17,6 +186,12 @@ def main():
         help="Path to the input file or folder containing the Obsidian notes.",
         required=True,
     )
+    parser.add_argument(
+        "--archive",
+        "-a",
+        type=Path,
+        help="Path to a zip or tar archive of the vault, read without extracting it - the input, bibtex and graphics paths are then relative to the archive root.",
+    )
 
     parser.add_argument(
         "--bibtex",
@@ -30,6 +205,12 @@ def main():
         type=Path,
         help="Path to the graphics folder, where all images are assumed to be stored.",
     )
+    parser.add_argument(
+        "--data",
+        "-dt",
+        type=Path,
+        help="Path to the folder with the CSV/TSV files of external tables, if not provided they're next to each note.",
+    )
     parser.add_argument(
         "--template",
         "-t",
@@ -43,7 +224,11 @@ def main():
         "-mt",
         type=Path,
         help="Path to the LaTeX file that will be generated, containing all compiled LaTeX.",
-        required=True,
+    )
+    parser.add_argument(
+        "--targets",
+        type=Path,
+        help="Path to a YAML list of outputs, each with its main-tex, template and hlevel-mapping, all rendered from a single parse.",
     )
     parser.add_argument(
         "--main-bibtex",
@@ -51,8 +236,64 @@ def main():
         type=Path,
         help="Path to the BibTeX file that will be generated, containing the references - only generated if citations are used.",
     )
+    parser.add_argument(
+        "--split-dir",
+        "-sd",
+        type=Path,
+        help="Path to a folder where each top-level section is written to its own LaTeX file, included from the main LaTeX file.",
+    )
+
+    parser.add_argument(
+        "--stream",
+        "-s",
+        action="store_true",
+        help="Write the LaTeX as it's rendered, reading a single input file line by line, or the notes of a folder one at a time, keeping memory bounded for very large inputs.",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        "-m",
+        type=Path,
+        help="Path to a JSON manifest that will be generated, listing the inputs of the conversion and their hashes - used by obsitex stale.",
+    )
 
     # Administrative options
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        help="Path to a Chrome trace-event JSON file, with spans for each note and block, viewable in chrome://tracing or Perfetto.",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        help="Path to a file where conversion metrics are written in the Prometheus text format, e.g.: for the node exporter textfile collector.",
+    )
+    parser.add_argument(
+        "--tikz-cache",
+        type=Path,
+        help="Path to a folder where TikZ pictures are compiled to PDFs once and included as graphics, instead of being drawn on every LaTeX run.",
+    )
+    parser.add_argument(
+        "--tikz-command",
+        type=str,
+        default=DEFAULT_TIKZ_COMMAND,
+        help="Command that compiles a standalone TikZ document, {input} is replaced by its path and a PDF with the same name must be written next to it.",
+    )
+    parser.add_argument(
+        "--tikz-preamble",
+        type=Path,
+        help="Path to a file with LaTeX added to the preamble of every TikZ picture, e.g.: packages and styles.",
+    )
+    parser.add_argument(
+        "--tikz-jobs",
+        type=int,
+        help="Maximum number of TikZ pictures compiled at once.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of processes that detect the blocks of the notes in parallel, the output is the same as with a single process.",
+    )
     parser.add_argument(
         "--debug",
         "-d",
@@ -60,43 +301,114 @@ def main():
         help="Enable debug mode, which will print additional information by enabling logging.",
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    if (args.main_tex is None) == (args.targets is None):
+        parser.error("exactly one of the arguments --main-tex or --targets is required")
+
+    if args.targets is not None and (
+        args.stream or args.split_dir is not None or args.template is not None
+    ):
+        parser.error(
+            "--targets can't be combined with --stream, --split-dir or --template"
+        )
 
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
-    if not args.input.exists():
+    # Inputs are read from the archive if one is given
+    if args.archive is not None:
+        filesystem = open_archive(args.archive)
+    else:
+        filesystem = LOCAL_FILESYSTEM
+
+    if not filesystem.is_file(args.input) and not filesystem.is_dir(args.input):
         raise FileNotFoundError(f"Input path {args.input} does not exist.")
 
-    # Read the template if it exists
-    if args.template is not None and args.template.is_file():
-        with open(args.template, "r") as file:
-            template = file.read()
-        logging.info(f"Using template from {args.template}.")
+    if args.manifest is not None and args.archive is not None:
+        raise ValueError("Manifests are only supported for inputs on the local disk.")
+
+    # Compile TikZ pictures apart, if requested
+    if args.tikz_cache is not None:
+        if args.tikz_preamble is not None:
+            with open(args.tikz_preamble, "r") as file:
+                tikz_preamble = file.read()
+        else:
+            tikz_preamble = ""
+
+        tikz_compiler = TikZCompiler(
+            args.tikz_cache,
+            command=args.tikz_command,
+            preamble=tikz_preamble,
+            max_workers=args.tikz_jobs,
+        )
     else:
-        template = DEFAULT_JINJA2_MAIN_TEMPLATE
-        logging.info("No template provided, using default template.")
+        tikz_compiler = None
 
-    # Create the parser
-    parser = ObsidianParser(
-        graphics_folder=args.graphics,
-        main_template=template,
-        bibtex_database_path=args.bibtex,
-        out_bitex_path=args.main_bibtex,
-    )
+    # Record spans for every note and block, if requested
+    hooks = EventHooks()
+
+    if args.trace is not None:
+        trace_sink = ChromeTraceSink()
+        hooks.add_sink(trace_sink)
+    else:
+        trace_sink = None
+
+    if args.metrics is not None:
+        hooks.add_sink(MetricsSink(METRICS_REGISTRY, DEFAULT_CACHE_MANAGER))
+
+    if args.targets is not None:
+        targets = load_targets(args.targets)
+    else:
+        targets = None
 
-    if args.input.is_dir():
-        parser.add_dir(args.input)
-    elif args.input.is_file():
-        parser.add_file(args.input)
+    # Detect blocks in worker processes, if requested
+    if args.jobs is not None and args.jobs > 1:
+        parse_executor = ProcessPoolExecutor(max_workers=args.jobs)
     else:
-        raise ValueError(f"Invalid path: {args.input}")
+        parse_executor = None
 
-    with open(args.main_tex, "w") as file:
-        file.write(parser.to_latex())
+    # Workers are shut down even if the conversion fails
+    try:
+        conversion = convert_input(
+            args.input,
+            main_tex=args.main_tex,
+            targets=targets,
+            template_path=args.template,
+            stream=args.stream,
+            split_dir=args.split_dir,
+            filesystem=filesystem,
+            graphics_folder=args.graphics,
+            data_folder=args.data,
+            bibtex_database_path=args.bibtex,
+            out_bitex_path=args.main_bibtex,
+            tikz_compiler=tikz_compiler,
+            parse_executor=parse_executor,
+            hooks=hooks,
+            cache_manager=DEFAULT_CACHE_MANAGER,
+        )
+    finally:
+        if parse_executor is not None:
+            parse_executor.shutdown()
 
-    print(f"Output written to {args.main_tex}")
+    if trace_sink is not None:
+        trace_sink.write(args.trace)
+        logging.info(f"Trace written to {args.trace}.")
+
+    if args.metrics is not None:
+        METRICS_REGISTRY.write_textfile(args.metrics)
+        logging.info(f"Metrics written to {args.metrics}.")
+
+    if args.manifest is not None:
+        conversion.build_manifest().write(args.manifest)
+        logging.info(f"Manifest written to {args.manifest}.")
+
+    if targets is not None:
+        for target in targets:
+            print(f"Output written to {target.out_path}")
+    else:
+        print(f"Output written to {args.main_tex}")
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -13,6 +13,22 @@ DEFAULT_JINJA2_MAIN_TEMPLATE = """
 %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 """
 
+# Used to split the main template when writing the output incrementally
+MAIN_CONTENT_PLACEHOLDER = "<OBSITEX-PARSED-LATEX-CONTENT>"
+
+# Longest line that is formatted, inline formatting takes linear time, but
+# lines this long are most likely pasted by mistake
+MAX_FORMATTED_LINE_LENGTH = 100_000
+
+# Lines of a streamed file are parsed in chunks, which end at the first line
+# no block continues once they're this long, and are never longer than the max
+STREAM_CHUNK_LINES = 256
+MAX_STREAM_CHUNK_LINES = 8192
+
+# Text of the notes of lazy jobs kept while converting, e.g.: for the pieces
+# of a note split around embeds
+MAX_SCANNED_NOTES_BYTES = 4 << 20
+
 DEFAULT_HLEVEL_MAPPING = {
     -2: "part",
     -1: "chapter",
@@ -39,3 +55,13 @@ SPECIAL_CALLOUTS = [
 
 QUOTE_MARKER = "> "
 CALLOUT_CONFIG_MARKER = "%%"
+
+# Notes read at once by the async API, unless a limit is given per call
+DEFAULT_MAX_CONCURRENT_READS = 16
+
+# Text jobs submitted to the parse executor ahead of the blocks being yielded
+MAX_PENDING_PARSE_JOBS = 64
+
+# Names of the chapters written to a split folder, so that chapters that are
+# no longer produced are removed, without touching other files
+SPLIT_INDEX_FILE = ".obsitex-chapters"
@@ -0,0 +1,123 @@
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from obsitex.constants import DEFAULT_JINJA2_MAIN_TEMPLATE
+from obsitex.filesystem import LOCAL_FILESYSTEM, FileSystem
+from obsitex.manifest import TEMPLATE_INPUT, Manifest
+from obsitex.parser import ObsidianParser
+from obsitex.targets import OutputTarget
+from obsitex.utils import write_if_changed, write_split_files
+
+
+class Conversion:
+    # Outcome of converting an input, kept to build its manifest afterwards
+    def __init__(
+        self,
+        parser: ObsidianParser,
+        output_paths: List[Path],
+        template_path: Optional[Path] = None,
+        targets: Optional[Sequence[OutputTarget]] = None,
+    ):
+        self.parser = parser
+        self.output_paths = output_paths
+        self.template_path = template_path
+        self.targets = targets
+
+    def build_manifest(self) -> Manifest:
+        manifest = self.parser.build_manifest(
+            self.output_paths, template_path=self.template_path
+        )
+
+        for target in self.targets or []:
+            if target.template_path is not None:
+                manifest.add_input(TEMPLATE_INPUT, target.template_path)
+
+        return manifest
+
+
+def read_template(template_path: Optional[Path]) -> str:
+    if template_path is not None and template_path.is_file():
+        with open(template_path, "r") as file:
+            template = file.read()
+        logging.info(f"Using template from {template_path}.")
+    else:
+        template = DEFAULT_JINJA2_MAIN_TEMPLATE
+        logging.info("No template provided, using default template.")
+
+    return template
+
+
+def convert_input(
+    input_path: Path,
+    main_tex: Optional[Path] = None,
+    targets: Optional[Sequence[OutputTarget]] = None,
+    template_path: Optional[Path] = None,
+    stream: bool = False,
+    split_dir: Optional[Path] = None,
+    filesystem: Optional[FileSystem] = None,
+    **parser_options,
+) -> Conversion:
+    # Converts a note or folder to the main file, or to each of the targets,
+    # the remaining options are passed to the parser, e.g.: the BibTeX paths
+    if (main_tex is None) == (targets is None):
+        raise ValueError("Exactly one of main_tex or targets must be given.")
+
+    if stream and split_dir is not None:
+        raise ValueError("Streaming can't be combined with a split output.")
+
+    if filesystem is None:
+        filesystem = LOCAL_FILESYSTEM
+
+    parser = ObsidianParser(
+        main_template=read_template(template_path),
+        filesystem=filesystem,
+        lazy_notes=stream,
+        **parser_options,
+    )
+
+    if filesystem.is_dir(input_path):
+        parser.add_dir(input_path)
+    elif filesystem.is_file(input_path):
+        parser.add_file(input_path, stream=stream)
+    else:
+        raise FileNotFoundError(f"Input path {input_path} does not exist.")
+
+    if targets is not None:
+        output_paths = [target.out_path for target in targets]
+    else:
+        output_paths = [main_tex]
+
+    for output_path in output_paths:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if targets is not None:
+        for target, target_latex in zip(targets, parser.to_latex_targets(targets)):
+            write_if_changed(target.out_path, target_latex)
+    elif stream:
+        with open(main_tex, "w") as file:
+            parser.write_latex(file)
+    elif split_dir is not None:
+        # Chapters are included relative to the folder of the main file
+        include_prefix = Path(
+            os.path.relpath(split_dir, main_tex.resolve().parent)
+        ).as_posix()
+        main_latex, chapters = parser.to_latex_split(
+            include_prefix=f"{include_prefix}/"
+        )
+
+        n_updated, n_removed = write_split_files(split_dir, chapters)
+        output_paths.extend(split_dir / f"{name}.tex" for name in chapters)
+
+        logging.info(
+            f"Updated {n_updated} of {len(chapters)} chapters, removed {n_removed}."
+        )
+        write_if_changed(main_tex, main_latex)
+    else:
+        write_if_changed(main_tex, parser.to_latex())
+
+    if parser.out_bitex_path is not None and len(parser.citation_keys) > 0:
+        output_paths.append(parser.out_bitex_path)
+
+    return Conversion(parser, output_paths, template_path, targets)
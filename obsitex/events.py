@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List
+
+# Events emitted while planning and parsing, each with a start and end time
+JOB_PLANNED = "job planned"
+NOTE_READ = "note read"
+BLOCK_DETECTED = "block detected"
+BLOCK_RENDERED = "block rendered"
+TEMPLATE_RENDERED = "template rendered"
+BIBLIOGRAPHY_WRITTEN = "bibliography written"
+LATEX_CONVERTED = "latex converted"
+CACHE_LOOKUP = "cache lookup"
+
+# Notes of lazy plans are read again when their text is loaded, which isn't
+# counted as another note read
+NOTE_RELOADED = "note reloaded"
+
+
+class Event:
+    def __init__(self, name: str, start: float, end: float, args: dict):
+        self.name = name
+
+        # Times are taken from time.perf_counter, in seconds
+        self.start = start
+        self.end = end
+
+        # Extra information on the event, e.g.: path, lines, block_class
+        self.args = args
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def __repr__(self):
+        return f'Event(name="{self.name}", duration={self.duration}, args={self.args})'
+
+
+class EventHooks:
+    def __init__(self):
+        self.sinks: List[Callable[[Event], None]] = []
+
+    @property
+    def enabled(self) -> bool:
+        # Emitters check this before building events, so that hooks cost
+        # almost nothing when no sink is attached
+        return len(self.sinks) > 0
+
+    def add_sink(self, sink: Callable[[Event], None]):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink: Callable[[Event], None]):
+        self.sinks.remove(sink)
+
+    def emit(self, name: str, start: float, end: float, **args):
+        event = Event(name, start, end, args)
+
+        for sink in self.sinks:
+            sink(event)
+
+
+def _to_trace_value(value):
+    if isinstance(value, (int, float)):
+        return value
+    elif isinstance(value, tuple):
+        return [_to_trace_value(item) for item in value]
+    else:
+        return str(value)
+
+
+class ChromeTraceSink:
+    def __init__(self):
+        # Trace events in the format read by chrome://tracing and Perfetto
+        self.trace_events: List[dict] = []
+
+        # Times are relative to the creation of the sink, not to the first
+        # event, since spans are emitted when they end, after later spans
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event):
+        with self._lock:
+            # Blocks are named after their class, to compare them in the viewer
+            self.trace_events.append(
+                {
+                    "name": event.args.get("block_class", event.name),
+                    "cat": event.name,
+                    "ph": "X",
+                    "ts": (event.start - self._origin) * 1e6,
+                    "dur": event.duration * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {
+                        key: _to_trace_value(value) for key, value in event.args.items()
+                    },
+                }
+            )
+
+    def write(self, path: Path):
+        with self._lock:
+            trace = {"traceEvents": self.trace_events, "displayTimeUnit": "ms"}
+
+        with open(path, "w") as file:
+            json.dump(trace, file)
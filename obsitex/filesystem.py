@@ -0,0 +1,211 @@
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+from abc import ABC, abstractmethod
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Dict, Iterable, Optional, Set, TextIO, Union
+
+
+class FileSystem(ABC):
+    # Notes, figures and BibTeX databases are read through a filesystem, so
+    # that vaults can be converted from archives or memory
+    @abstractmethod
+    def is_file(self, path: Path) -> bool:
+        pass
+
+    @abstractmethod
+    def is_dir(self, path: Path) -> bool:
+        pass
+
+    @abstractmethod
+    def open_binary(self, path: Path) -> BinaryIO:
+        pass
+
+    def open_text(self, path: Path, newline: Optional[str] = None) -> TextIO:
+        # Lines are translated to "\n" unless newline is given, e.g.: "" for
+        # csv, whose quoted fields may span lines
+        return io.TextIOWrapper(self.open_binary(path), "utf-8", newline=newline)
+
+    def read_text(self, path: Path) -> str:
+        with self.open_text(path) as file:
+            return file.read()
+
+    def hash_file(self, path: Path) -> str:
+        sha256 = hashlib.sha256()
+
+        with self.open_binary(path) as file:
+            for chunk in iter(lambda: file.read(1 << 16), b""):
+                sha256.update(chunk)
+
+        return sha256.hexdigest()
+
+    def resolve(self, path: Path) -> Path:
+        # Path as written to the LaTeX output, e.g.: for figures
+        return path
+
+    def mtime(self, path: Path) -> Optional[int]:
+        # Modification time used to invalidate cached files, None if unknown,
+        # in which case the file isn't cached
+        return None
+
+
+class LocalFileSystem(FileSystem):
+    def is_file(self, path: Path) -> bool:
+        return Path(path).is_file()
+
+    def is_dir(self, path: Path) -> bool:
+        return Path(path).is_dir()
+
+    def open_binary(self, path: Path) -> BinaryIO:
+        return open(path, "rb")
+
+    def open_text(self, path: Path, newline: Optional[str] = None) -> TextIO:
+        return open(path, "r", newline=newline)
+
+    def resolve(self, path: Path) -> Path:
+        return Path(path).resolve()
+
+    def mtime(self, path: Path) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+
+def normalize_path(path: Union[str, Path]) -> str:
+    # Paths inside archives and memory are relative to their root, with "/"
+    # as the separator, and the root itself is ""
+    parts = []
+
+    for part in PurePosixPath(Path(path).as_posix()).parts:
+        if part == "..":
+            if len(parts) > 0:
+                parts.pop()
+        elif part not in (".", "/"):
+            parts.append(part)
+
+    return "/".join(parts)
+
+
+class IndexedFileSystem(FileSystem):
+    # Filesystem whose files are known upfront, directories are implied by
+    # the paths of the files, since archives don't always list them
+    def __init__(self, file_paths: Iterable[str]):
+        self._files: Set[str] = set()
+        self._dirs: Set[str] = {""}
+
+        for file_path in file_paths:
+            self.index_file(file_path)
+
+    def index_file(self, file_path: str):
+        file_path = normalize_path(file_path)
+        self._files.add(file_path)
+        self._dirs.update(
+            normalize_path(parent) for parent in PurePosixPath(file_path).parents
+        )
+
+    def is_file(self, path: Path) -> bool:
+        return normalize_path(path) in self._files
+
+    def is_dir(self, path: Path) -> bool:
+        return normalize_path(path) in self._dirs
+
+    def open_binary(self, path: Path) -> BinaryIO:
+        if not self.is_file(path):
+            raise FileNotFoundError(f"File {path} not found in {self}.")
+
+        return self.open_member(normalize_path(path))
+
+    @abstractmethod
+    def open_member(self, file_path: str) -> BinaryIO:
+        pass
+
+    def resolve(self, path: Path) -> Path:
+        return Path(normalize_path(path))
+
+
+class MemoryFileSystem(IndexedFileSystem):
+    def __init__(self, files: Dict[str, Union[str, bytes]]):
+        # Contents are indexed by path, text is stored encoded
+        self._contents: Dict[str, bytes] = {}
+        super().__init__([])
+
+        for file_path, content in files.items():
+            self.write_text(file_path, content)
+
+    def write_text(self, file_path: str, content: Union[str, bytes]):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+
+        self._contents[normalize_path(file_path)] = content
+        self.index_file(file_path)
+
+    def open_member(self, file_path: str) -> BinaryIO:
+        return io.BytesIO(self._contents[file_path])
+
+    def __repr__(self):
+        return f"MemoryFileSystem({len(self._contents)} files)"
+
+
+class ZipFileSystem(IndexedFileSystem):
+    def __init__(self, archive: Union[Path, io.IOBase]):
+        # Members are read in place, without extracting the archive
+        self.archive = archive
+        self._zip_file = zipfile.ZipFile(archive)
+        self._members = {
+            normalize_path(info.filename): info
+            for info in self._zip_file.infolist()
+            if not info.is_dir()
+        }
+        super().__init__(self._members.keys())
+
+    def open_member(self, file_path: str) -> BinaryIO:
+        return self._zip_file.open(self._members[file_path])
+
+    def close(self):
+        self._zip_file.close()
+
+    def __repr__(self):
+        return f"ZipFileSystem({self.archive})"
+
+
+class TarFileSystem(IndexedFileSystem):
+    def __init__(self, archive: Union[Path, io.IOBase]):
+        # Compressed archives are supported, members are read in place
+        self.archive = archive
+
+        if isinstance(archive, io.IOBase):
+            self._tar_file = tarfile.open(fileobj=archive)
+        else:
+            self._tar_file = tarfile.open(archive)
+
+        self._members = {
+            normalize_path(member.name): member
+            for member in self._tar_file.getmembers()
+            if member.isfile()
+        }
+        super().__init__(self._members.keys())
+
+    def open_member(self, file_path: str) -> BinaryIO:
+        return self._tar_file.extractfile(self._members[file_path])
+
+    def close(self):
+        self._tar_file.close()
+
+    def __repr__(self):
+        return f"TarFileSystem({self.archive})"
+
+
+def open_archive(archive_path: Path) -> IndexedFileSystem:
+    if zipfile.is_zipfile(archive_path):
+        return ZipFileSystem(archive_path)
+    elif tarfile.is_tarfile(archive_path):
+        return TarFileSystem(archive_path)
+    else:
+        raise ValueError(f"Path {archive_path} is not a zip or tar archive.")
+
+
+# Used when no filesystem is given, reads from the local disk
+LOCAL_FILESYSTEM = LocalFileSystem()
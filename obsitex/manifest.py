@@ -0,0 +1,159 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import bibtexparser
+
+from obsitex.filesystem import LOCAL_FILESYSTEM
+
+MANIFEST_VERSION = 1
+
+# Kinds of inputs that can be recorded in a manifest
+NOTE_INPUT = "note"
+FIGURE_INPUT = "figure"
+TEMPLATE_INPUT = "template"
+BIBTEX_INPUT = "bibtex"
+
+
+def hash_file(path: Path) -> Optional[str]:
+    if not LOCAL_FILESYSTEM.is_file(path):
+        return None
+
+    return LOCAL_FILESYSTEM.hash_file(path)
+
+
+def hash_bibtex_entries(
+    path: Path, citations: Iterable[str]
+) -> Dict[str, Optional[str]]:
+    # Hash of each cited entry, None if it's missing, so that only changes to
+    # the entries a document cites make it stale
+    if not LOCAL_FILESYSTEM.is_file(path):
+        return {key: None for key in citations}
+
+    with LOCAL_FILESYSTEM.open_text(path) as file:
+        entries = {entry["ID"]: entry for entry in bibtexparser.load(file).entries}
+
+    return {
+        key: (
+            hashlib.sha256(
+                json.dumps(entries[key], sort_keys=True).encode()
+            ).hexdigest()
+            if key in entries
+            else None
+        )
+        for key in citations
+    }
+
+
+def _manifest_path(path: Path) -> str:
+    return str(Path(path).resolve())
+
+
+class Manifest:
+    def __init__(self, outputs: Sequence[Path] = ()):
+        # Files generated by the conversion
+        self.outputs: List[str] = [_manifest_path(path) for path in outputs]
+
+        # Inputs of the conversion, indexed by path, as (kind, content hash)
+        self.inputs: Dict[str, Dict[str, Optional[str]]] = {}
+
+        # Citation keys used in the document
+        self.citations: List[str] = []
+
+    def add_input(self, kind: str, path: Path):
+        self.inputs[_manifest_path(path)] = {"kind": kind, "hash": hash_file(path)}
+
+    def add_bibtex(self, path: Path, citations: Iterable[str]):
+        # Databases are often shared by many documents, thus the cited entries
+        # are also hashed one by one
+        citations = sorted(set(citations))
+        self.add_input(BIBTEX_INPUT, path)
+        self.inputs[_manifest_path(path)]["entries"] = hash_bibtex_entries(
+            path, citations
+        )
+        self.add_citations(citations)
+
+    def add_citations(self, citations: Iterable[str]):
+        self.citations = sorted(set(self.citations).union(citations))
+
+    def depends_on(self, changed_paths: Iterable[Path]) -> bool:
+        for path in changed_paths:
+            recorded = self.inputs.get(_manifest_path(path), None)
+
+            if recorded is not None and (
+                "entries" not in recorded or self._entries_changed(path, recorded)
+            ):
+                return True
+
+        return False
+
+    def changed_inputs(self) -> List[str]:
+        # Inputs whose contents no longer match the recorded hash, databases
+        # only if any of the cited entries changed
+        return [
+            path
+            for path, recorded in self.inputs.items()
+            if hash_file(Path(path)) != recorded["hash"]
+            and ("entries" not in recorded or self._entries_changed(path, recorded))
+        ]
+
+    def _entries_changed(self, path: Union[str, Path], recorded: dict) -> bool:
+        entries = recorded["entries"]
+        return hash_bibtex_entries(Path(path), entries) != entries
+
+    def missing_outputs(self) -> List[str]:
+        return [path for path in self.outputs if not Path(path).is_file()]
+
+    def is_stale(self, changed_paths: Optional[Iterable[Path]] = None) -> bool:
+        # If the changed paths aren't given, compare the hashes of all inputs
+        if len(self.missing_outputs()) > 0:
+            return True
+        elif changed_paths is not None:
+            return self.depends_on(changed_paths)
+        else:
+            return len(self.changed_inputs()) > 0
+
+    def to_dict(self) -> dict:
+        return {
+            "version": MANIFEST_VERSION,
+            "outputs": self.outputs,
+            "inputs": self.inputs,
+            "citations": self.citations,
+        }
+
+    def write(self, path: Path):
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    @staticmethod
+    def load(path: Path) -> "Manifest":
+        with open(path, "r") as file:
+            contents = json.load(file)
+
+        if contents.get("version") != MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported manifest version {contents.get('version')} in {path}."
+            )
+
+        manifest = Manifest()
+        manifest.outputs = contents["outputs"]
+        manifest.inputs = contents["inputs"]
+        manifest.citations = contents["citations"]
+
+        return manifest
+
+
+def find_stale_outputs(
+    manifests: Sequence[Manifest], changed_paths: Optional[Iterable[Path]] = None
+) -> List[str]:
+    if changed_paths is not None:
+        changed_paths = list(changed_paths)
+
+    stale_outputs = []
+
+    for manifest in manifests:
+        if manifest.is_stale(changed_paths):
+            stale_outputs.extend(manifest.outputs)
+
+    return stale_outputs
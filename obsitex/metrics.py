@@ -0,0 +1,404 @@
+import bisect
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from obsitex.cache import DEFAULT_CACHE_MANAGER, CacheManager
+from obsitex.events import BLOCK_DETECTED, LATEX_CONVERTED, NOTE_READ, Event
+
+# Upper bounds, in seconds, of the buckets of the duration histograms
+DEFAULT_DURATION_BUCKETS = (
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+    60.0,
+)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str]) -> str:
+    if len(label_names) == 0:
+        return ""
+
+    labels = ",".join(
+        f'{name}="{_escape_label_value(value)}"'
+        for name, value in zip(label_names, label_values)
+    )
+    return f"{{{labels}}}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    elif float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+class Metric(ABC):
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    @property
+    @abstractmethod
+    def type(self) -> str:
+        pass
+
+    def _label_values(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"Metric {self.name} has labels {self.label_names}, got {tuple(labels)}"
+            )
+
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, str, float]]:
+        # Suffixed name, formatted labels and value of each sample
+        pass
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    @property
+    def type(self) -> str:
+        return "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError(f"Counter {self.name} can only be increased.")
+
+        label_values = self._label_values(labels)
+
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [
+            (self.name, _format_labels(self.label_names, label_values), value)
+            for label_values, value in values
+        ]
+
+
+class Histogram(Metric):
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_DURATION_BUCKETS,
+    ):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+        # Observations in each bucket, not cumulative, the last is +Inf
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    @property
+    def type(self) -> str:
+        return "histogram"
+
+    def observe(self, value: float, **labels):
+        label_values = self._label_values(labels)
+        bucket_index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            if label_values not in self._counts:
+                self._counts[label_values] = [0] * (len(self.buckets) + 1)
+                self._sums[label_values] = 0.0
+
+            self._counts[label_values][bucket_index] += 1
+            self._sums[label_values] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            return sum(self._counts.get(self._label_values(labels), []))
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            counts = {key: list(value) for key, value in self._counts.items()}
+            sums = dict(self._sums)
+
+        samples = []
+        label_names = self.label_names + ("le",)
+
+        for label_values in sorted(counts):
+            cumulative = 0
+
+            for bound, bucket_count in zip(
+                self.buckets + (float("inf"),), counts[label_values]
+            ):
+                cumulative += bucket_count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        _format_labels(
+                            label_names, label_values + (_format_value(bound),)
+                        ),
+                        cumulative,
+                    )
+                )
+
+            labels = _format_labels(self.label_names, label_values)
+            samples.append((f"{self.name}_sum", labels, sums[label_values]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+
+        return samples
+
+
+class CacheStatsCounter(Metric):
+    # Counts of the caches, by namespace, read from the cache managers when
+    # exposed, since caches count all lookups, e.g.: of formatted lines
+    def __init__(self, name: str, help: str, stat: str):
+        super().__init__(name, help, ("cache",))
+        self.stat = stat
+        self._cache_managers: List[CacheManager] = []
+
+    @property
+    def type(self) -> str:
+        return "counter"
+
+    def add_cache_manager(self, cache_manager: CacheManager):
+        with self._lock:
+            if all(existing is not cache_manager for existing in self._cache_managers):
+                self._cache_managers.append(cache_manager)
+
+    def value(self, cache: str) -> float:
+        return dict(self._values()).get((cache,), 0)
+
+    def _values(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            cache_managers = list(self._cache_managers)
+
+        values: Dict[Tuple[str, ...], float] = {}
+
+        for cache_manager in cache_managers:
+            for cache, stats in cache_manager.stats().items():
+                values[(cache,)] = values.get((cache,), 0) + getattr(stats, self.stat)
+
+        return sorted(values.items())
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [
+            (self.name, _format_labels(self.label_names, label_values), value)
+            for label_values, value in self._values()
+        ]
+
+
+class MetricsRegistry:
+    # Metrics are kept for the lifetime of the process, thus all conversions
+    # reporting to the same registry are aggregated
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name, None)
+
+            if existing is None:
+                self._metrics[metric.name] = metric
+                return metric
+
+        if (
+            type(existing) is not type(metric)
+            or existing.label_names != metric.label_names
+        ):
+            raise ValueError(
+                f"Metric {metric.name} is already registered as a different {existing.type}."
+            )
+
+        return existing
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter(name, help, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_DURATION_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram(name, help, label_names, buckets))
+
+    def cache_stats_counter(
+        self, name: str, help: str, stat: str, cache_manager: CacheManager
+    ) -> CacheStatsCounter:
+        metric = self._get_or_create(CacheStatsCounter(name, help, stat))
+        metric.add_cache_manager(cache_manager)
+        return metric
+
+    def expose(self) -> str:
+        # Prometheus text exposition format
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+
+        return "".join(metric.expose() for metric in metrics)
+
+    def write_textfile(self, path: Union[str, Path]):
+        # Written atomically, since the node exporter textfile collector may
+        # read the file at any time
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(
+            "w", dir=path.parent, prefix=f".{path.name}.", delete=False
+        ) as file:
+            file.write(self.expose())
+
+        os.replace(file.name, path)
+
+
+# Used when no registry is given, shared by all conversions in the process
+METRICS_REGISTRY = MetricsRegistry()
+
+
+class MetricsSink:
+    def __init__(
+        self,
+        registry: Optional[MetricsRegistry] = None,
+        cache_manager: Optional[CacheManager] = None,
+    ):
+        self.registry = registry if registry is not None else METRICS_REGISTRY
+
+        # Caches are counted from the cache manager of the parser, which is
+        # shared by all parsers unless one is given
+        if cache_manager is None:
+            cache_manager = DEFAULT_CACHE_MANAGER
+
+        self.notes_read = self.registry.counter(
+            "obsitex_notes_read_total", "Notes read from the vault."
+        )
+        self.bytes_in = self.registry.counter(
+            "obsitex_input_bytes_total", "Characters of the notes read."
+        )
+        self.blocks = self.registry.counter(
+            "obsitex_blocks_total", "Blocks detected, by class.", ("block_class",)
+        )
+        self.conversions = self.registry.counter(
+            "obsitex_conversions_total", "Conversions to LaTeX."
+        )
+        self.bytes_out = self.registry.counter(
+            "obsitex_output_bytes_total", "Characters of the LaTeX written."
+        )
+        self.citations = self.registry.counter(
+            "obsitex_citations_resolved_total",
+            "Citation keys included in bibliographies.",
+        )
+        self.cache_hits = self.registry.cache_stats_counter(
+            "obsitex_cache_hits_total",
+            "Lookups found in a cache.",
+            "hits",
+            cache_manager,
+        )
+        self.cache_misses = self.registry.cache_stats_counter(
+            "obsitex_cache_misses_total",
+            "Lookups missing from a cache.",
+            "misses",
+            cache_manager,
+        )
+        self.cache_evictions = self.registry.cache_stats_counter(
+            "obsitex_cache_evictions_total",
+            "Entries evicted from a cache to keep it under its limits.",
+            "evictions",
+            cache_manager,
+        )
+        self.cache_invalidations = self.registry.cache_stats_counter(
+            "obsitex_cache_invalidations_total",
+            "Entries dropped from a cache because their file changed.",
+            "invalidations",
+            cache_manager,
+        )
+        self.durations = self.registry.histogram(
+            "obsitex_phase_duration_seconds",
+            "Duration of each phase, e.g.: note read, block rendered.",
+            ("phase",),
+        )
+
+    def __call__(self, event: Event):
+        self.durations.observe(event.duration, phase=event.name)
+
+        if event.name == NOTE_READ:
+            self.notes_read.inc()
+            self.bytes_in.inc(event.args.get("bytes", 0))
+        elif event.name == BLOCK_DETECTED:
+            self.blocks.inc(block_class=event.args.get("block_class", "unknown"))
+        elif event.name == LATEX_CONVERTED:
+            self.conversions.inc()
+            self.bytes_out.inc(event.args.get("bytes", 0))
+            self.citations.inc(event.args.get("citations", 0))
+
+
+def start_metrics_server(
+    port: int,
+    host: str = "127.0.0.1",
+    registry: Optional[MetricsRegistry] = None,
+) -> ThreadingHTTPServer:
+    # Serves the metrics from a daemon thread, e.g.: for long running workers,
+    # stop it with server.shutdown()
+    if registry is None:
+        registry = METRICS_REGISTRY
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            content = registry.expose().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="obsitex-metrics", daemon=True
+    ).start()
+
+    return server
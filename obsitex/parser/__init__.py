@@ -1,16 +1,55 @@
+import asyncio
+import functools
 import logging
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
 from pathlib import Path
-from typing import Optional, Sequence, Type
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    TextIO,
+    Tuple,
+    Type,
+    Union,
+)
 
 import bibtexparser
-from jinja2 import Environment
+from jinja2 import Environment, Template
 
+from obsitex.cache import DEFAULT_CACHE_MANAGER, CacheManager, use_cache_manager
 from obsitex.constants import (
     DEFAULT_APPENDIX_MARKER,
     DEFAULT_BIBLIOGRAPHY_MARKER,
     DEFAULT_HLEVEL_MAPPING,
     DEFAULT_JINJA2_JOB_TEMPLATE,
     DEFAULT_JINJA2_MAIN_TEMPLATE,
+    DEFAULT_MAX_CONCURRENT_READS,
+    MAIN_CONTENT_PLACEHOLDER,
+    MAX_PENDING_PARSE_JOBS,
+)
+from obsitex.events import (
+    BIBLIOGRAPHY_WRITTEN,
+    BLOCK_DETECTED,
+    BLOCK_RENDERED,
+    LATEX_CONVERTED,
+    TEMPLATE_RENDERED,
+    Event,
+    EventHooks,
+)
+from obsitex.filesystem import LOCAL_FILESYSTEM, FileSystem
+from obsitex.manifest import (
+    FIGURE_INPUT,
+    NOTE_INPUT,
+    TEMPLATE_INPUT,
+    Manifest,
 )
 from obsitex.parser.blocks import (
     PARSEABLE_BLOCKS,
@@ -19,13 +58,139 @@ from obsitex.parser.blocks import (
     Paragraph,
     Section,
 )
+from obsitex.parser.context import ConversionContext, ConversionResult
+from obsitex.parser.formatting import iter_block_chunks
+from obsitex.parser.source import SourceLines
+from obsitex.parser.tikz import TikZCompiler
 from obsitex.planner import ExecutionPlan
-from obsitex.planner.jobs import AddBibliography, AddHeader, AddText, PlannedJob
+from obsitex.planner.outline import Outline
+from obsitex.problems import Problem
+from obsitex.targets import OutputTarget
+from obsitex.planner.jobs import (
+    AddBibliography,
+    AddHeader,
+    AddText,
+    LoadText,
+    PlannedJob,
+    StreamText,
+)
+from obsitex.utils import write_if_changed
 
 # Increase logging level to bibtexparser - avoid warnings
 logging.getLogger("bibtexparser").setLevel(logging.ERROR)
 
 
+def _with_cache_manager(method):
+    # Functions without access to the parser, e.g.: format_text, use the
+    # cache manager of the parser while converting
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with use_cache_manager(self.cache_manager):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def detect_blocks(
+    lines: Sequence[str],
+    job: PlannedJob,
+    first_line: int,
+    context: ConversionContext,
+    parseable_blocks: Sequence[Type[LaTeXBlock]],
+    hooks: EventHooks,
+) -> Iterator[LaTeXBlock]:
+    curr_i, n_lines = 0, len(lines)
+    configs = context.job_configs(job)
+
+    while curr_i < n_lines:
+        start, start_i = time.perf_counter(), curr_i
+        found_block = False
+
+        for block_class in parseable_blocks:
+            try:
+                block_instance = block_class.detect_block(lines, curr_i)
+            except ValueError as error:
+                if context.problems is None:
+                    raise ValueError(
+                        f"{error} ({job.source_path}:{first_line + curr_i + 1})"
+                    ) from error
+
+                # When checking, the line is kept as a paragraph and
+                # detection goes on to find further problems
+                context.problems.append(
+                    Problem(job.source_path, first_line + curr_i, str(error))
+                )
+                break
+
+            if block_instance is not None:
+                block, curr_i = block_instance
+
+                if isinstance(block, Section):
+                    block.hlevel += context.latest_parsed_hlevel
+
+                found_block = True
+                break
+
+        if not found_block:
+            # If remaining, assume it's a paragraph
+            block = Paragraph(lines[curr_i])
+
+        block.metadata = configs
+        block.source_path = job.source_path
+        block.line_range = (first_line + start_i, first_line + curr_i)
+
+        if hooks.enabled:
+            hooks.emit(
+                BLOCK_DETECTED,
+                start,
+                time.perf_counter(),
+                path=block.source_path,
+                lines=block.line_range,
+                block_class=block.__class__.__name__,
+            )
+
+        yield block
+        curr_i += 1
+
+
+def _detect_job_blocks(
+    job: Union[AddText, LoadText],
+    text: Optional[str],
+    hlevel: int,
+    in_appendix: bool,
+    parseable_blocks: Sequence[Type[LaTeXBlock]],
+    collect_problems: bool,
+    collect_events: bool,
+) -> Tuple[List[LaTeXBlock], Optional[List[Tuple[int, Problem]]], List[Event]]:
+    # Runs in a worker process, with the state the job would have if parsed
+    # in order, events are collected and emitted again by the parser, and
+    # problems are returned with the index of the block they precede
+    context = ConversionContext(None, hlevel)
+    context.in_appendix = in_appendix
+    context.problems = [] if collect_problems else None
+
+    hooks, events = EventHooks(), []
+
+    if collect_events:
+        hooks.add_sink(events.append)
+
+    lines = SourceLines(text if text is not None else job.text)
+    blocks, indexed_problems = [], []
+
+    for block in detect_blocks(
+        lines, job, job.first_line, context, parseable_blocks, hooks
+    ):
+        if context.problems is not None:
+            indexed_problems.extend(
+                (len(blocks), problem) for problem in context.problems
+            )
+            context.problems.clear()
+
+        blocks.append(block)
+
+    return blocks, indexed_problems if collect_problems else None, events
+
+
 class ObsidianParser:
     def __init__(
         self,
@@ -33,6 +198,7 @@ class ObsidianParser:
         implictly_add_bibtex: bool = True,
         out_bitex_path: Optional[Path] = None,
         graphics_folder: Optional[Path] = None,
+        data_folder: Optional[Path] = None,
         job_template: str = DEFAULT_JINJA2_JOB_TEMPLATE,
         main_template: str = DEFAULT_JINJA2_MAIN_TEMPLATE,
         hlevel_mapping: dict = DEFAULT_HLEVEL_MAPPING,
@@ -41,6 +207,13 @@ class ObsidianParser:
         base_hlevel: int = 0,
         custom_blocks: Sequence[Type[LaTeXBlock]] = [],
         default_parseable_blocks: Sequence[Type[LaTeXBlock]] = PARSEABLE_BLOCKS,
+        hooks: Optional[EventHooks] = None,
+        filesystem: Optional[FileSystem] = None,
+        tikz_compiler: Optional[TikZCompiler] = None,
+        lazy_notes: bool = False,
+        cache_manager: Optional[CacheManager] = None,
+        executor: Optional[Executor] = None,
+        parse_executor: Optional[Executor] = None,
     ):
         self.job_template = job_template
         self.main_template = main_template
@@ -50,145 +223,686 @@ class ObsidianParser:
         self.out_bitex_path = out_bitex_path
         self.parseable_blocks = custom_blocks + default_parseable_blocks
 
+        # Hooks are shared with the execution plan, sinks receive all events
+        self.hooks = hooks if hooks is not None else EventHooks()
+
+        # Notes, figures and the BibTeX database are read from here
+        self.filesystem = filesystem if filesystem is not None else LOCAL_FILESYSTEM
+
+        # Bounded caches of notes, formatted lines, templates, etc., shared
+        # by all parsers unless one is given
+        self.cache_manager = (
+            cache_manager if cache_manager is not None else DEFAULT_CACHE_MANAGER
+        )
+
+        # The async API runs planning and conversions here, None for the
+        # default executor of the event loop - must share the parser's memory,
+        # e.g.: a thread pool
+        self.executor = executor
+
+        # If given, e.g.: a process pool, the blocks of text jobs are detected
+        # there in parallel, and merged in the order of the jobs
+        self.parse_executor = parse_executor
+
         # Construct an execution plan, which will collect the jobs to run from
         # the files and pths provided
         self.execution_plan = ExecutionPlan(
             bibtex_database_path=bibtex_database_path,
             implictly_add_bibtex=implictly_add_bibtex,
+            hooks=self.hooks,
+            filesystem=self.filesystem,
+            lazy=lazy_notes,
+            cache_manager=self.cache_manager,
         )
 
         # Extra arguments that should be injected when converting to latex
         self.extra_args = {
             "hlevel_mapping": self.hlevel_mapping,
             "graphics_folder": graphics_folder,
+            "data_folder": data_folder,
+            "filesystem": self.filesystem,
+            "tikz_compiler": tikz_compiler,
+            "hooks": self.hooks,
         }
 
-        # Flag to continuously check if in appendix
-        self.in_appendix = False
-
-        # Set of blocks that will be added to the main tex file
+        # Blocks, files read and keys cited by the latest conversion of the
+        # execution plan
         self.blocks: Sequence[LaTeXBlock] = []
+        self.dependencies: Set[Path] = set()
+        self.citation_keys: Set[str] = set()
 
-        # Keep track of the latest header level
+        # Headers of notes are offset by this level
         self.base_hlevel = base_hlevel
-        self.latest_parsed_hlevel = base_hlevel
 
-    def add_file(self, file_path: Path, adjust_hlevel: bool = True):
+    def add_file(
+        self, file_path: Path, adjust_hlevel: bool = True, stream: bool = False
+    ):
         # By default adding a file assumes a single file structure
         if adjust_hlevel:
-            self.latest_parsed_hlevel = self.base_hlevel - 1
+            self.execution_plan.initial_hlevel = self.base_hlevel - 1
 
-        self.execution_plan.add_file(file_path)
+        self.execution_plan.add_file(file_path, stream=stream)
 
     def add_dir(self, dir_path: Path):
         self.execution_plan.add_dir(dir_path)
 
-    def apply_jobs(self):
-        for job in self.execution_plan.iter_jobs():
-            self.parse_job(job)
+    async def add_file_async(
+        self,
+        file_path: Path,
+        adjust_hlevel: bool = True,
+        stream: bool = False,
+        executor: Optional[Executor] = None,
+    ):
+        await self._run_in_executor(
+            functools.partial(self.add_file, file_path, adjust_hlevel, stream),
+            executor,
+        )
 
-    def to_latex(self) -> str:
-        # Reset the parser blocks and apply
-        self.blocks = []
-        self.apply_jobs()
+    async def add_dir_async(
+        self,
+        dir_path: Path,
+        executor: Optional[Executor] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENT_READS,
+    ):
+        # Notes are read concurrently first, then planned from memory, since
+        # the links of each note are only known once it's read
+        await self.execution_plan.prefetch_dir_async(
+            dir_path,
+            executor=executor if executor is not None else self.executor,
+            max_concurrency=max_concurrency,
+        )
+        await self._run_in_executor(functools.partial(self.add_dir, dir_path), executor)
 
-        # Create template for job level and main
-        job_template = Environment().from_string(self.job_template)
-        main_template = Environment().from_string(self.main_template)
+    async def convert_async(
+        self,
+        plan: Optional[ExecutionPlan] = None,
+        executor: Optional[Executor] = None,
+    ) -> ConversionResult:
+        # Cancelling the awaiting task stops the conversion at the next job
+        # or block, since threads can't be interrupted
+        cancel_event = threading.Event()
+
+        try:
+            return await self._run_in_executor(
+                functools.partial(self.convert, plan, cancel_event), executor
+            )
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+
+    async def to_latex_async(self, executor: Optional[Executor] = None) -> str:
+        result = await self.convert_async(executor=executor)
+        await self._run_in_executor(
+            functools.partial(
+                self._finish_conversion,
+                result.blocks,
+                result.dependencies,
+                result.bibtex,
+                result.citation_keys,
+            ),
+            executor,
+        )
 
-        # Render each block onto the job template
-        rendered_blocks = "\n\n".join(
-            [
-                job_template.render(
-                    parsed_latex_content=block.formatted_text(**self.extra_args),
-                    **block.metadata,
+        return result.latex
+
+    def _run_in_executor(
+        self, function: Callable, executor: Optional[Executor] = None
+    ) -> asyncio.Future:
+        if executor is None:
+            executor = self.executor
+
+        return asyncio.get_running_loop().run_in_executor(executor, function)
+
+    def outline(self) -> Outline:
+        # Headings of the planned notes, at the levels they're converted at
+        return self.execution_plan.outline(self.base_hlevel)
+
+    def new_context(self, plan: Optional[ExecutionPlan] = None) -> ConversionContext:
+        if plan is None:
+            plan = self.execution_plan
+
+        if plan.initial_hlevel is not None:
+            initial_hlevel = plan.initial_hlevel
+        else:
+            initial_hlevel = self.base_hlevel
+
+        return ConversionContext(plan, initial_hlevel)
+
+    @_with_cache_manager
+    def convert(
+        self,
+        plan: Optional[ExecutionPlan] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> ConversionResult:
+        # Doesn't change the parser nor the plan, thus a configured parser can
+        # convert many plans at once, e.g.: from different threads
+        start = time.perf_counter()
+        context = self.new_context(plan)
+        context.cancel_event = cancel_event
+        context.blocks = list(self.iter_blocks(context))
+        self._prepare_blocks(context.blocks)
+        latex = self._render_main(
+            self._render_blocks(context.blocks, context),
+            self._global_configs(context.blocks),
+        )
+        self._emit_converted(start, context, len(latex))
+
+        return ConversionResult(
+            latex,
+            context.bibtex,
+            context.blocks,
+            context.dependencies,
+            context.citation_keys,
+        )
+
+    def iter_blocks(self, context: ConversionContext) -> Iterator[LaTeXBlock]:
+        if self.parse_executor is not None:
+            yield from self._iter_blocks_parallel(context)
+            return
+
+        for job in context.plan.iter_jobs(context.citation_keys):
+            context.check_cancelled()
+            yield from self.iter_job_blocks(job, context)
+
+    def _iter_blocks_parallel(self, context: ConversionContext) -> Iterator[LaTeXBlock]:
+        # The header level and appendix state of each job only depend on the
+        # jobs before it, thus are known when the job is submitted, and the
+        # blocks are yielded in the order of the jobs
+        pending: "deque[Union[List[LaTeXBlock], Tuple[Future, dict]]]" = deque()
+
+        def iter_pending(max_pending: int) -> Iterator[LaTeXBlock]:
+            while len(pending) > max_pending:
+                entry = pending.popleft()
+
+                if isinstance(entry, list):
+                    yield from entry
+                    continue
+
+                future, configs = entry
+                blocks, indexed_problems, events = future.result()
+                indexed_problems = deque(indexed_problems or ())
+
+                for event in events:
+                    self.hooks.emit(event.name, event.start, event.end, **event.args)
+
+                for index, block in enumerate(blocks):
+                    # Problems are reported as if detected in order
+                    while len(indexed_problems) > 0 and indexed_problems[0][0] == index:
+                        context.problems.append(indexed_problems.popleft()[1])
+
+                    block.metadata = configs
+                    yield block
+
+        try:
+            for job in context.plan.iter_jobs(context.citation_keys):
+                context.check_cancelled()
+
+                if not isinstance(job, (AddText, LoadText)):
+                    # Streamed files add citations while parsed, and the
+                    # bibliography is rendered from them, thus both run in turn
+                    if isinstance(job, (StreamText, AddBibliography)):
+                        yield from iter_pending(0)
+                        yield from self.iter_job_blocks(job, context)
+                    else:
+                        pending.append(list(self.iter_job_blocks(job, context)))
+
+                    continue
+
+                marker_block = self._enter_appendix(job, context)
+
+                if marker_block is not None:
+                    pending.append([marker_block])
+
+                text = (
+                    context.plan.load_text(job, context.scanned_notes)
+                    if isinstance(job, LoadText)
+                    else None
+                )
+                future = self.parse_executor.submit(
+                    _detect_job_blocks,
+                    job,
+                    text,
+                    context.latest_parsed_hlevel,
+                    context.in_appendix,
+                    self.parseable_blocks,
+                    context.problems is not None,
+                    self.hooks.enabled,
                 )
-                for block in self.blocks
+                pending.append((future, context.job_configs(job)))
+
+                yield from iter_pending(MAX_PENDING_PARSE_JOBS)
+
+            yield from iter_pending(0)
+        finally:
+            # E.g.: when cancelled, jobs that haven't started are dropped
+            for entry in pending:
+                if not isinstance(entry, list):
+                    entry[0].cancel()
+
+    def to_latex(self) -> str:
+        result = self.convert()
+        self._finish_conversion(
+            result.blocks, result.dependencies, result.bibtex, result.citation_keys
+        )
+
+        return result.latex
+
+    @_with_cache_manager
+    def to_latex_split(self, include_prefix: str = "") -> Tuple[str, Dict[str, str]]:
+        start = time.perf_counter()
+        context = self.new_context()
+        context.blocks = list(self.iter_blocks(context))
+        self._prepare_blocks(context.blocks)
+
+        # Each section at the top-most level starts a new chapter, which is
+        # rendered to its own file and included in the main file
+        sections = [block for block in context.blocks if isinstance(block, Section)]
+        top_hlevel = min([section.hlevel for section in sections], default=None)
+
+        main_parts: List[Union[str, List[LaTeXBlock]]] = [[]]
+        chapters: Dict[str, List[LaTeXBlock]] = {}
+        current_chapter = None
+
+        for block in context.blocks:
+            if isinstance(block, Section) and block.hlevel == top_hlevel:
+                # Files are named after the chapter, not its position, so that
+                # adding or moving a chapter doesn't rename the ones after it
+                chapter_name = re.sub(r"\W+", "_", block.title).strip("_").lower()
+                chapter_name = chapter_name or "chapter"
+                current_chapter, n_repeated = chapter_name, 1
+
+                while current_chapter in chapters:
+                    n_repeated += 1
+                    current_chapter = f"{chapter_name}_{n_repeated}"
+
+                chapters[current_chapter] = [block]
+                main_parts.append(f"\\include{{{include_prefix}{current_chapter}}}")
+                main_parts.append([])
+            elif isinstance(block, MarkerBlock):
+                # Markers control the flow of the document, keep them in the main file
+                current_chapter = None
+                main_parts[-1].append(block)
+            elif current_chapter is not None:
+                chapters[current_chapter].append(block)
+            else:
+                main_parts[-1].append(block)
+
+        rendered_main = "\n\n".join(
+            [
+                part if isinstance(part, str) else self._render_blocks(part, context)
+                for part in main_parts
+                if len(part) > 0
             ]
         )
+        rendered_chapters = {
+            name: self._render_blocks(blocks, context)
+            for name, blocks in chapters.items()
+        }
+        rendered_main = self._render_main(
+            rendered_main, self._global_configs(context.blocks)
+        )
+        self._emit_converted(
+            start,
+            context,
+            len(rendered_main) + sum(map(len, rendered_chapters.values())),
+        )
+        self._finish_conversion(
+            context.blocks, context.dependencies, context.bibtex, context.citation_keys
+        )
 
-        # Render the main template with the rendered blocks
-        # the global variables are shared by all blocks, we use the first
+        return rendered_main, rendered_chapters
+
+    @_with_cache_manager
+    def to_latex_targets(self, targets: Sequence[OutputTarget]) -> List[str]:
+        # Planning, detection and formatting run once for all targets, only
+        # the blocks that depend on the target, e.g.: sections, and the main
+        # template are rendered for each target
+        start = time.perf_counter()
+        context = self.new_context()
+        context.blocks = list(self.iter_blocks(context))
+        self._prepare_blocks(context.blocks)
+
+        job_template = self._template(self.job_template)
+        shared_blocks = [
+            (
+                self._render_block(block, job_template, context)
+                if len(block.target_args) == 0
+                else None
+            )
+            for block in context.blocks
+        ]
+        global_configs = self._global_configs(context.blocks)
+        rendered_targets = []
+
+        for target in targets:
+            extra_args = dict(self.extra_args, **target.extra_args)
+            rendered_blocks = "\n\n".join(
+                [
+                    (
+                        rendered_block
+                        if rendered_block is not None
+                        else self._render_block(
+                            block, job_template, context, extra_args
+                        )
+                    )
+                    for block, rendered_block in zip(context.blocks, shared_blocks)
+                ]
+            )
+            rendered_targets.append(
+                self._render_main(rendered_blocks, global_configs, target.main_template)
+            )
+
+        self._emit_converted(start, context, sum(map(len, rendered_targets)))
+        self._finish_conversion(
+            context.blocks, context.dependencies, context.bibtex, context.citation_keys
+        )
+
+        return rendered_targets
+
+    def _template(self, template: str) -> Template:
+        # Templates are compiled once and shared by all conversions
+        return self.cache_manager.namespace("templates").get_or_compute(
+            template,
+            lambda: Environment().from_string(template),
+            size=lambda _: len(template),
+        )
+
+    def _global_configs(self, blocks: Sequence[LaTeXBlock]) -> dict:
+        # The global variables are shared by all blocks, we use the first
         # block for simplicity
-        if len(self.blocks) > 0:
-            global_configs = self.blocks[0].metadata
-        else:
-            global_configs = {}
+        if len(blocks) > 0:
+            return blocks[0].metadata
+
+        return {}
+
+    def _prepare_blocks(self, blocks: Sequence[LaTeXBlock]):
+        for block in blocks:
+            block.prepare(**self.extra_args)
+
+    def _render_blocks(
+        self, blocks: Sequence[LaTeXBlock], context: ConversionContext
+    ) -> str:
+        job_template = self._template(self.job_template)
 
-        return main_template.render(
+        # Render each block onto the job template
+        return "\n\n".join(
+            [self._render_block(block, job_template, context) for block in blocks]
+        )
+
+    def _render_block(
+        self,
+        block: LaTeXBlock,
+        job_template: Template,
+        context: ConversionContext,
+        extra_args: Optional[dict] = None,
+    ) -> str:
+        context.check_cancelled()
+
+        if extra_args is None:
+            extra_args = self.extra_args
+
+        start = time.perf_counter()
+        rendered_block = job_template.render(
+            parsed_latex_content=block.formatted_text(**extra_args),
+            **block.metadata,
+        )
+        context.dependencies.update(block.dependencies(**extra_args))
+
+        if self.hooks.enabled:
+            self.hooks.emit(
+                BLOCK_RENDERED,
+                start,
+                time.perf_counter(),
+                path=block.source_path,
+                lines=block.line_range,
+                block_class=block.__class__.__name__,
+            )
+
+        return rendered_block
+
+    def _render_main(
+        self,
+        rendered_blocks: str,
+        global_configs: dict,
+        main_template: Optional[str] = None,
+    ) -> str:
+        if main_template is None:
+            main_template = self.main_template
+
+        start = time.perf_counter()
+
+        # Render the main template with the rendered blocks
+        rendered_main = self._template(main_template).render(
             parsed_latex_content=rendered_blocks,
             **global_configs,
         )
 
-    def parse_job(self, job: PlannedJob) -> str:
-        if not self.in_appendix:
-            self.in_appendix = job.is_in_appendix
+        if self.hooks.enabled:
+            self.hooks.emit(
+                TEMPLATE_RENDERED, start, time.perf_counter(), bytes=len(rendered_main)
+            )
 
-            # If in appendix, add the appendix marker
-            if self.in_appendix:
-                marker_block = MarkerBlock(self.appendix_marker)
-                marker_block.metadata = job.configs
-                self.blocks.append(marker_block)
-                logging.info("Added appendix marker to the parser.")
+        return rendered_main
+
+    @_with_cache_manager
+    def write_latex(self, out_file: TextIO):
+        # Renders job by job, writing directly to the output, so that blocks
+        # aren't all kept in memory at once - e.g.: when streaming large files
+        start = time.perf_counter()
+        context = self.new_context()
+        job_template = self._template(self.job_template)
+        main_suffix, n_written = None, 0
+
+        for block in self.iter_blocks(context):
+            if main_suffix is None:
+                # The global variables are taken from the first block
+                main_prefix, main_suffix = self._split_main(block.metadata)
+                n_written += out_file.write(main_prefix)
+            else:
+                n_written += out_file.write("\n\n")
+
+            block.prepare(**self.extra_args)
+            n_written += out_file.write(
+                self._render_block(block, job_template, context)
+            )
+
+        if main_suffix is None:
+            main_prefix, main_suffix = self._split_main({})
+            n_written += out_file.write(main_prefix)
+
+        n_written += out_file.write(main_suffix)
+        self._emit_converted(start, context, n_written)
+        self._finish_conversion(
+            [], context.dependencies, context.bibtex, context.citation_keys
+        )
 
-        # Given a job, returns the corresponding latex code
+    def _split_main(self, global_configs: dict) -> Tuple[str, str]:
+        start = time.perf_counter()
+        rendered_main = self._template(self.main_template).render(
+            parsed_latex_content=MAIN_CONTENT_PLACEHOLDER,
+            **global_configs,
+        )
+
+        if rendered_main.count(MAIN_CONTENT_PLACEHOLDER) != 1:
+            raise ValueError(
+                "The main template must render the parsed content exactly once to be written incrementally."
+            )
+
+        main_prefix, main_suffix = rendered_main.split(MAIN_CONTENT_PLACEHOLDER)
+
+        if self.hooks.enabled:
+            self.hooks.emit(
+                TEMPLATE_RENDERED, start, time.perf_counter(), bytes=len(rendered_main)
+            )
+
+        return main_prefix, main_suffix
+
+    def _emit_converted(self, start: float, context: ConversionContext, n_bytes: int):
+        if self.hooks.enabled:
+            self.hooks.emit(
+                LATEX_CONVERTED,
+                start,
+                time.perf_counter(),
+                bytes=n_bytes,
+                citations=(
+                    len(context.citation_keys) if context.bibtex is not None else 0
+                ),
+            )
+
+    def _finish_conversion(
+        self,
+        blocks: Sequence[LaTeXBlock],
+        dependencies: Set[Path],
+        bibtex: Optional[str],
+        citation_keys: Set[str],
+    ):
+        # Keeps the latest conversion of the execution plan on the parser, and
+        # writes the bibliography to the configured output
+        self.blocks = blocks
+        self.dependencies = dependencies
+        self.citation_keys = citation_keys
+
+        if bibtex is None:
+            return
+
+        if self.out_bitex_path is None:
+            raise ValueError("Bibliography was added but no output path was set.")
+
+        start = time.perf_counter()
+        write_if_changed(self.out_bitex_path, bibtex)
+
+        if self.hooks.enabled:
+            self.hooks.emit(
+                BIBLIOGRAPHY_WRITTEN,
+                start,
+                time.perf_counter(),
+                path=self.out_bitex_path,
+                citations=len(citation_keys),
+            )
+
+    def build_manifest(
+        self, outputs: Sequence[Path], template_path: Optional[Path] = None
+    ) -> Manifest:
+        # Must be called after converting, since figures are only resolved
+        # when their blocks are rendered, and streamed citations when parsed
+        manifest = Manifest(outputs)
+
+        for note_path in self.execution_plan.read_paths:
+            manifest.add_input(NOTE_INPUT, note_path)
+
+        for dependency_path in sorted(self.dependencies):
+            manifest.add_input(FIGURE_INPUT, dependency_path)
+
+        if template_path is not None:
+            manifest.add_input(TEMPLATE_INPUT, template_path)
+
+        citation_keys = self.citation_keys
+
+        if len(citation_keys) > 0 and self.execution_plan.bibtex_database_path:
+            manifest.add_bibtex(self.execution_plan.bibtex_database_path, citation_keys)
+
+        return manifest
+
+    def iter_job_blocks(
+        self, job: PlannedJob, context: ConversionContext
+    ) -> Iterator[LaTeXBlock]:
+        marker_block = self._enter_appendix(job, context)
+
+        if marker_block is not None:
+            yield marker_block
+
+        # Given a job, yields the corresponding latex blocks
         if isinstance(job, AddHeader):
-            self.latest_parsed_hlevel = job.level
-            return self._parse_header(job)
-        elif isinstance(job, AddText):
-            return self._parse_text(job)
+            context.latest_parsed_hlevel = job.level
+            yield from self._parse_header(job)
+        elif isinstance(job, (AddText, LoadText)):
+            yield from self._parse_text(job, context)
+        elif isinstance(job, StreamText):
+            yield from self._parse_stream(job, context)
         elif isinstance(job, AddBibliography):
-            return self._parse_bibliography(job)
+            yield from self._parse_bibliography(job, context)
         else:
             raise ValueError(f"Unknown job type {job}")
 
-    def _parse_header(self, job: AddHeader):
+    def _enter_appendix(
+        self, job: PlannedJob, context: ConversionContext
+    ) -> Optional[MarkerBlock]:
+        if not context.in_appendix:
+            context.in_appendix = job.is_in_appendix
+
+            # If in appendix, add the appendix marker
+            if context.in_appendix:
+                marker_block = MarkerBlock(self.appendix_marker)
+                marker_block.metadata = job.configs
+                logging.info("Added appendix marker to the parser.")
+                return marker_block
+
+        return None
+
+    def _parse_header(self, job: AddHeader) -> Iterator[LaTeXBlock]:
         section_block = Section(job.level, job.header)
-        self.blocks.append(section_block)
+        section_block.source_path = job.source_path
         logging.info(
             f'Added header "{job.header}" with level {job.level} to the parser.'
         )
+        yield section_block
 
-    def _parse_text(self, job: AddText):
-        lines = job.text.split("\n")
-        curr_i = 0
-        initial_block_count = len(self.blocks)
+    def _parse_text(
+        self, job: Union[AddText, LoadText], context: ConversionContext
+    ) -> Iterator[LaTeXBlock]:
+        n_blocks = 0
 
-        while curr_i < len(lines):
-            found_block = False
+        # Lazy jobs are read just before being parsed, and the text released
+        # once their blocks are, e.g.: when writing the output incrementally
+        if isinstance(job, LoadText):
+            lines = SourceLines(context.plan.load_text(job, context.scanned_notes))
+        else:
+            lines = SourceLines(job.text)
 
-            for block_class in self.parseable_blocks:
-                block_instance = block_class.detect_block(lines, curr_i)
+        for block in self._detect_blocks(lines, job, job.first_line, context):
+            n_blocks += 1
+            yield block
 
-                if block_instance is not None:
-                    block, curr_i = block_instance
+        logging.info(f"Added {n_blocks} blocks to the parser.")
 
-                    if isinstance(block, Section):
-                        block.hlevel += self.latest_parsed_hlevel
+    def _parse_stream(
+        self, job: StreamText, context: ConversionContext
+    ) -> Iterator[LaTeXBlock]:
+        n_blocks = 0
 
-                    found_block = True
-                    block.metadata = job.configs
-                    self.blocks.append(block)
-                    break
+        # Blocks never span chunks, thus only one chunk is kept in memory
+        lines = context.plan.iter_stream_lines(job, context.citation_keys)
 
-            if not found_block:
-                # If remaining, assume it's a paragraph
-                paragraph_block = Paragraph(lines[curr_i])
-                paragraph_block.metadata = job.configs
-                self.blocks.append(paragraph_block)
+        for chunk_index, chunk, plain in iter_block_chunks(lines):
+            chunk_first_line = job.first_line + chunk_index
 
-            curr_i += 1
+            # Lines of unclosed equations or code blocks are kept as paragraphs
+            parseable_blocks = [] if plain else self.parseable_blocks
 
-        logging.info(
-            f"Added {len(self.blocks) - initial_block_count} blocks to the parser, total {len(self.blocks)}."
-        )
+            for block in detect_blocks(
+                chunk, job, chunk_first_line, context, parseable_blocks, self.hooks
+            ):
+                n_blocks += 1
+                yield block
 
-    def _parse_bibliography(self, job: AddBibliography):
-        if self.out_bitex_path is None:
-            raise ValueError("Bibliography was added but no output path was set.")
+        logging.info(f"Added {n_blocks} blocks to the parser from {job.file_path}.")
 
+    def _detect_blocks(
+        self,
+        lines: Sequence[str],
+        job: PlannedJob,
+        first_line: int,
+        context: ConversionContext,
+    ) -> Iterator[LaTeXBlock]:
+        return detect_blocks(
+            lines, job, first_line, context, self.parseable_blocks, self.hooks
+        )
+
+    def _parse_bibliography(
+        self, job: AddBibliography, context: ConversionContext
+    ) -> Iterator[LaTeXBlock]:
         # Select the keys to be included in the bibliography, and export
-        with open(job.bibtex_path, "r") as file:
+        with self.filesystem.open_text(job.bibtex_path) as file:
             bib_database = bibtexparser.load(file)
 
         # Index the bib tex keys and verify if all are present
@@ -200,15 +914,13 @@ class ObsidianParser:
                 f"Missing {len(missing_keys)} keys in bibliography: {missing_keys}"
             )
 
-        # Write the selected entries to a new BibTeX file
+        # Keep the selected entries, written once the conversion is done
         new_db = bibtexparser.bparser.BibTexParser()  # Get a new BibDatabase instance
-        new_db.entries = [bib_keys[key] for key in job.citations]
-
-        with open(self.out_bitex_path, "w") as file:
-            bibtexparser.dump(new_db, file)
+        new_db.entries = [bib_keys[key] for key in sorted(job.citations)]
+        context.bibtex = bibtexparser.dumps(new_db)
 
         # Add the proper marker
         marker_block = MarkerBlock(self.bibliography_marker)
         marker_block.metadata = job.configs
-        self.blocks.append(marker_block)
         logging.info("Added bibliography marker to the parser.")
+        yield marker_block
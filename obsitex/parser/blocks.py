@@ -1,16 +1,28 @@
+import copy
+import importlib.util
 import re
+import subprocess
 from abc import ABC, abstractmethod
 from io import StringIO
 from pathlib import Path
-from typing import Optional, Sequence, Tuple, Type
+from typing import List, Optional, Sequence, Tuple, Type
 
 import yaml
 
+from obsitex.cache import MISSING, current_cache_manager
 from obsitex.constants import CALLOUT_CONFIG_MARKER, QUOTE_MARKER, SPECIAL_CALLOUTS
+from obsitex.filesystem import LOCAL_FILESYSTEM, FileSystem
 from obsitex.parser.formatting import detect_command, find_next_index, format_text
+from obsitex.parser.source import MappedLines, join_lines
+from obsitex.parser.tables import find_table_source, load_table_rows
+from obsitex.utils import section_label
 
 
 class LaTeXBlock(ABC):
+    # Extra arguments that change the formatted text between output targets,
+    # blocks without any are formatted once for all targets
+    target_args: Sequence[str] = ()
+
     def __init__(self, content, in_latex=False):
         self.content = content
         self.parent = None  # Only Section and Project objects can be parents
@@ -18,6 +30,11 @@ class LaTeXBlock(ABC):
         self._is_after_appendix = False
         self.metadata = {}
 
+        # Where the block was found, set by the parser, lines are zero based
+        # and the end line is inclusive
+        self.source_path: Optional[Path] = None
+        self.line_range: Optional[Tuple[int, int]] = None
+
     @property
     def is_after_appendix(self):
         return self._is_after_appendix
@@ -34,12 +51,41 @@ class LaTeXBlock(ABC):
                 return "\n".join(self.content)
         else:
             if isinstance(self.content, str):
-                text_lines = format_text([self.content])
+                text_lines = self.format_lines([self.content])
             else:
-                text_lines = format_text(self.content)
+                text_lines = self.format_lines(self.content)
 
         return "\n".join(text_lines)
 
+    def format_lines(self, lines: Sequence[str]) -> List[str]:
+        # Lines of the block in LaTeX, errors point to the block, e.g.: for
+        # lines over the length limit
+        try:
+            return format_text(lines)
+        except ValueError as error:
+            raise ValueError(f"{error} ({self.location})") from error
+
+    def dependencies(self, **kwargs) -> Sequence[Path]:
+        # Files, other than notes, the block reads when formatted
+        return []
+
+    def validate(self, **kwargs) -> Sequence[str]:
+        # Problems that would make formatting fail, found without formatting
+        return []
+
+    def prepare(self, **kwargs):
+        # Called on all blocks before any is formatted, so that slow work can
+        # start in the background, e.g.: compiling TikZ pictures
+        pass
+
+    @property
+    def location(self) -> str:
+        # Used to point to the block in error messages, lines are one based
+        if self.line_range is None:
+            return str(self.source_path)
+
+        return f"{self.source_path}:{self.line_range[0] + 1}"
+
     @staticmethod
     @abstractmethod
     def detect_block(
@@ -73,19 +119,23 @@ class MarkerBlock(LaTeXBlock):
 
 
 class Section(LaTeXBlock):
+    target_args = ("hlevel_mapping",)
+
     def __init__(self, hlevel: int, title: str):
         super().__init__(None)
         self.hlevel = hlevel
         self.title = title
-
-    @property
-    def label(self):
-        reformatted_title = re.sub(r"\W", "_", self.title)
-        return f"sec:{reformatted_title}"
+        self.label = section_label(title)
 
     def __repr__(self):
         return f'Section(hlevel={self.hlevel}, title="{self.title}")'
 
+    def validate(self, **kwargs) -> Sequence[str]:
+        if self.hlevel not in kwargs.get("hlevel_mapping", {}):
+            return [f"Header level {self.hlevel} not found in hlevel_mapping"]
+
+        return []
+
     def formatted_text(self, **kwargs):
         if "hlevel_mapping" not in kwargs:
             raise ValueError("hlevel_mapping not provided in kwargs")
@@ -93,7 +143,9 @@ class Section(LaTeXBlock):
             hlevel_mapping = kwargs["hlevel_mapping"]
 
         if self.hlevel not in hlevel_mapping:
-            raise ValueError(f"Header level {self.hlevel} not found in hlevel_mapping")
+            raise ValueError(
+                f"Header level {self.hlevel} not found in hlevel_mapping ({self.location})"
+            )
 
         content = (
             f"\\{hlevel_mapping[self.hlevel]}{{{self.title}}}\\label{{{self.label}}}"
@@ -109,7 +161,8 @@ class Section(LaTeXBlock):
 
         if header_match is not None:
             hlevel = len(header_match.group(1))
-            title = header_match.group(2)
+            # Stripped as in the outline, so both have the same label
+            title = header_match.group(2).strip()
 
             return Section(hlevel, title), index
 
@@ -149,7 +202,7 @@ class Equation(LaTeXBlock):
             end_index = find_next_index(lines, _is_equation, index + 1)
 
             # Extract the equation content
-            equation_content = "\n".join(lines[index + 1 : end_index])
+            equation_content = join_lines(lines, index + 1, end_index)
 
             return Equation(equation_content, label), end_index
 
@@ -169,7 +222,7 @@ class AbstractList(LaTeXBlock):
         list_type = self.list_type()
         content = f"\\begin{{{list_type}}}\n"
 
-        for line in format_text(self.lines):
+        for line in self.format_lines(self.lines):
             content += f"\t\\item {line}\n"
 
         content += f"\\end{{{list_type}}}\n"
@@ -197,11 +250,9 @@ class AbstractList(LaTeXBlock):
             # Find the end of the list
             end_index = find_next_index(lines, not_is_list_item, index + 1)
 
-            # Extract the list content
-            item_lines = lines[index:end_index]
-
-            # Remove the list markers
-            list_content = [re.sub(regex_pattern, "", line) for line in item_lines]
+            # Extract the list content, the list markers are only removed
+            # when the lines are formatted
+            list_content = MappedLines(lines[index:end_index], regex_pattern, "")
 
             return instance_class(list_content), end_index
 
@@ -238,7 +289,7 @@ class Quote(LaTeXBlock):
     def formatted_text(self, **kwargs):
         content = "\\begin{displayquote}\n"
 
-        for line in format_text(self.lines):
+        for line in self.format_lines(self.lines):
             content += f"\t{line}\n"
 
         content += "\\end{displayquote}\n"
@@ -287,10 +338,10 @@ class AbstractCallout(LaTeXBlock):
             end_index = find_next_index(
                 lines, lambda line: not line.startswith(">"), index + 1
             )
-            callout_lines = lines[index + 1 : end_index]
-
             # Remove config marker from all
-            callout_lines = [l.replace(QUOTE_MARKER, "") for l in callout_lines]
+            callout_lines = MappedLines(
+                lines[index + 1 : end_index], re.escape(QUOTE_MARKER), ""
+            )
 
             # Might contain configurations in the callout, need to confirm
             start_config_marker_index = find_next_index(
@@ -308,12 +359,22 @@ class AbstractCallout(LaTeXBlock):
                     start_config_marker_index + 1 : end_config_marker_index
                 ]
 
-                try:
-                    configs = yaml.safe_load("\n".join(config_lines))
-                except:
-                    raise ValueError(
-                        f"Could not parse configurations in callout ({callout}): {config_lines}"
-                    )
+                # Callouts of the same kind often share their configurations
+                config_text = "\n".join(config_lines)
+                cache = current_cache_manager().namespace("callout configs")
+                configs = cache.get(config_text)
+
+                if configs is MISSING:
+                    try:
+                        configs = yaml.safe_load(config_text)
+                    except:
+                        raise ValueError(
+                            f"Could not parse configurations in callout ({callout}): {config_lines}"
+                        )
+
+                    cache.put(config_text, configs, size=len(config_text))
+
+                configs = copy.deepcopy(configs)
 
                 # Change the end of the call out lines
                 callout_lines = callout_lines[:start_config_marker_index]
@@ -326,59 +387,228 @@ class AbstractCallout(LaTeXBlock):
 class Table(AbstractCallout):
     def __init__(self, caption: str, lines: Sequence[str], configs: dict):
         super().__init__(caption, lines, configs)
+        self._table_caption = caption
 
-        try:
-            import pandas as pd
-        except:
-            raise ImportError(
-                "You defined a table, but pandas is not installed. Please install pandas to use tables."
+        # Parsed when first formatted, thus checking a vault neither imports
+        # pandas nor formats the cells
+        self._df = None
+        self._latex_content = None
+
+    @property
+    def df(self):
+        if self._df is None:
+            try:
+                import pandas as pd
+            except:
+                raise ImportError(
+                    "You defined a table, but pandas is not installed. Please install pandas to use tables."
+                )
+
+            # Parse the table
+            table_content = "\n".join(self.format_lines(self.lines))
+
+            df = (
+                pd.read_table(StringIO(table_content), sep="|", engine="python")
+                .dropna(how="all", axis=1)
+                .dropna(how="all")
             )
 
-        # Parse the table
-        table_content = "\n".join(format_text(self.lines))
+            # Clean up column names and content (strip leading/trailing whitespace)
+            df.columns = df.columns.str.strip()
+            df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
 
-        df = (
-            pd.read_table(StringIO(table_content), sep="|", engine="python")
-            .dropna(how="all", axis=1)
-            .dropna(how="all")
-        )
+            # Step 2: Filter out any rows filled with '----' (typically separators)
+            df = df[~df.apply(lambda row: row.str.contains("----").any(), axis=1)]
 
-        # Clean up column names and content (strip leading/trailing whitespace)
-        df.columns = df.columns.str.strip()
-        df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
+            self._df = df
 
-        # Step 2: Filter out any rows filled with '----' (typically separators)
-        df = df[~df.apply(lambda row: row.str.contains("----").any(), axis=1)]
+        return self._df
 
-        self.df = df
+    @property
+    def latex_content(self) -> str:
+        if self._latex_content is None:
+            try:
+                df = self.df
+            except ValueError as error:
+                raise ValueError(f"{error} ({self.location})") from error
+
+            # Check for latex specific configurations in the configs
+            position = self.configs.get("position", None)
+            column_format = self.configs.get(
+                "column_format", "l" + "r" * (len(df.columns) - 1)
+            )
+            centering = self.configs.get("centering", True)
 
-        # Check for latex specific configurations in the configs
-        position = self.configs.get("position", None)
-        column_format = self.configs.get(
-            "column_format", "l" + "r" * (len(df.columns) - 1)
-        )
-        centering = self.configs.get("centering", True)
+            self._latex_content = df.to_latex(
+                index=False,
+                caption=self._table_caption,
+                position=position,
+                column_format=column_format,
+            )
 
-        self.latex_content = df.to_latex(
-            index=False,
-            caption=caption,
-            position=position,
-            column_format=column_format,
-        )
+            if centering:
+                split_latex_content = self._latex_content.split("\n")
+                split_latex_content.insert(1, "\\centering")
+                self._latex_content = "\n".join(split_latex_content)
+
+        return self._latex_content
+
+    def validate(self, **kwargs) -> Sequence[str]:
+        # Only the shape of the rows is checked, i.e.: no row has more cells
+        # than the header, which is what makes parsing the table fail
+        if importlib.util.find_spec("pandas") is None:
+            return ["You defined a table, but pandas is not installed."]
 
-        if centering:
-            split_latex_content = self.latex_content.split("\n")
-            split_latex_content.insert(1, "\\centering")
-            self.latex_content = "\n".join(split_latex_content)
+        if len(self.lines) == 0 or "|" not in self.lines[0]:
+            return [f'Table "{self.caption}" must start with a header row.']
+
+        n_header_cells = self.lines[0].count("|")
+
+        for row_index, row in enumerate(self.lines):
+            if row.count("|") > n_header_cells:
+                return [
+                    f'Row {row_index + 1} of table "{self.caption}" has more cells than its header.'
+                ]
+
+        return []
 
     def formatted_text(self, **kwargs):
         return self.latex_content
 
+    @staticmethod
+    def from_callout(caption: str, lines: Sequence[str], configs: dict):
+        # Tables are either written in markdown, or read from a data file
+        source = find_table_source(lines, configs)
+
+        if source is not None:
+            configs = configs if isinstance(configs, dict) else {}
+            return ExternalTable(caption, lines, configs, source)
+
+        return Table(caption, lines, configs)
+
     @staticmethod
     def detect_block(
         lines: Sequence[str], index: int
     ) -> Optional[Tuple["LaTeXBlock", int]]:
-        return AbstractCallout.detect_block(lines, index, "table", Table)
+        return AbstractCallout.detect_block(lines, index, "table", Table.from_callout)
+
+
+class ExternalTable(AbstractCallout):
+    def __init__(self, caption: str, lines: Sequence[str], configs: dict, source: str):
+        super().__init__(caption, lines, configs)
+        self.source = source
+
+        # Table latex configs, the rows are configured in tables.py
+        self.label = self.configs.get("label", None)
+        self.position = self.configs.get("position", None)
+        self.centering = self.configs.get("centering", True)
+        self.longtable = self.configs.get("longtable", False)
+        self.column_format = self.configs.get("column_format", None)
+
+    def resolve_data_path(
+        self, data_folder: Optional[Path], filesystem: FileSystem
+    ) -> Path:
+        # Without a data folder, files are next to the note
+        if data_folder is not None:
+            base_folder = data_folder
+        elif self.source_path is not None:
+            base_folder = self.source_path.parent
+        else:
+            raise ValueError(
+                f"You defined an external table, but no data folder was provided ({self.location})"
+            )
+
+        return filesystem.resolve(base_folder / self.source)
+
+    def dependencies(self, **kwargs) -> Sequence[Path]:
+        return [
+            self.resolve_data_path(
+                kwargs.get("data_folder", None),
+                kwargs.get("filesystem", LOCAL_FILESYSTEM),
+            )
+        ]
+
+    def validate(self, **kwargs) -> Sequence[str]:
+        filesystem = kwargs.get("filesystem", LOCAL_FILESYSTEM)
+
+        try:
+            data_path = self.resolve_data_path(
+                kwargs.get("data_folder", None), filesystem
+            )
+        except ValueError as error:
+            return [str(error)]
+
+        if not filesystem.is_file(data_path):
+            return [f"Could not find table data {data_path}"]
+
+        return []
+
+    def formatted_text(self, **kwargs):
+        filesystem = kwargs.get("filesystem", LOCAL_FILESYSTEM)
+        data_path = self.resolve_data_path(kwargs.get("data_folder", None), filesystem)
+
+        if not filesystem.is_file(data_path):
+            raise FileNotFoundError(
+                f"Could not find table data {data_path} ({self.location})"
+            )
+
+        try:
+            rows = load_table_rows(
+                data_path, filesystem, self.configs, kwargs.get("hooks", None)
+            )
+        except ValueError as error:
+            raise ValueError(f"{error} ({self.location})") from error
+
+        column_format = self.column_format
+
+        if column_format is None:
+            column_format = "l" + "r" * (rows.n_columns - 1)
+
+        # Same layout as the tables written in markdown
+        caption = self.format_lines([self.caption])[0]
+        header = ""
+
+        if rows.header is not None:
+            header = " & ".join(rows.header) + " \\\\\n\\midrule\n"
+
+        if self.longtable:
+            content = f"\\begin{{longtable}}{{{column_format}}}\n"
+            content += f"\\caption{{{caption}}}"
+
+            if self.label is not None:
+                content += f"\\label{{tab:{self.label}}}"
+
+            content += " \\\\\n"
+
+            # Header repeated on every page
+            content += f"\\toprule\n{header}\\endfirsthead\n"
+            content += f"\\toprule\n{header}\\endhead\n"
+            content += "\\bottomrule\n\\endfoot\n"
+            content += rows.body
+            content += "\\end{longtable}\n"
+
+            return content
+
+        content = "\\begin{table}"
+
+        if self.position is not None:
+            content += f"[{self.position}]"
+
+        content += "\n"
+
+        if self.centering:
+            content += "\\centering\n"
+
+        content += f"\\caption{{{caption}}}\n"
+
+        if self.label is not None:
+            content += f"\\label{{tab:{self.label}}}\n"
+
+        content += f"\\begin{{tabular}}{{{column_format}}}\n\\toprule\n{header}"
+        content += rows.body
+        content += "\\bottomrule\n\\end{tabular}\n\\end{table}\n"
+
+        return content
 
 
 class Figure(AbstractCallout):
@@ -399,18 +629,49 @@ class Figure(AbstractCallout):
         self.centering = self.configs.get("centering", True)
         self.width = self.configs.get("width", 0.5)
 
-    def formatted_text(self, **kwargs):
-        graphics_foler: Optional[Path] = kwargs.get("graphics_folder", None)
-
-        if graphics_foler is None:
+    def resolve_image_path(
+        self, graphics_folder: Optional[Path], filesystem: FileSystem
+    ) -> Path:
+        if graphics_folder is None:
             raise ValueError(
                 "You defined a figure, but no graphics folder was provided."
             )
 
-        image_path = (graphics_foler / self.target_image).resolve()
+        return filesystem.resolve(graphics_folder / self.target_image)
 
-        if not image_path.exists():
-            raise FileNotFoundError(f"Could not find image {image_path}")
+    def dependencies(self, **kwargs) -> Sequence[Path]:
+        return [
+            self.resolve_image_path(
+                kwargs.get("graphics_folder", None),
+                kwargs.get("filesystem", LOCAL_FILESYSTEM),
+            )
+        ]
+
+    def validate(self, **kwargs) -> Sequence[str]:
+        filesystem = kwargs.get("filesystem", LOCAL_FILESYSTEM)
+
+        try:
+            image_path = self.resolve_image_path(
+                kwargs.get("graphics_folder", None), filesystem
+            )
+        except ValueError as error:
+            return [str(error)]
+
+        if not filesystem.is_file(image_path):
+            return [f"Could not find image {image_path}"]
+
+        return []
+
+    def formatted_text(self, **kwargs):
+        filesystem = kwargs.get("filesystem", LOCAL_FILESYSTEM)
+        image_path = self.resolve_image_path(
+            kwargs.get("graphics_folder", None), filesystem
+        )
+
+        if not filesystem.is_file(image_path):
+            raise FileNotFoundError(
+                f"Could not find image {image_path} ({self.location})"
+            )
 
         content = "\\begin{figure}"
 
@@ -425,7 +686,7 @@ class Figure(AbstractCallout):
         content += f"\\includegraphics[width={self.width}\\textwidth]{{{image_path}}}\n"
 
         # Format the caption, since it might contain citations
-        caption = format_text([self.caption])[0]
+        caption = self.format_lines([self.caption])[0]
         content += f"\\caption{{{caption}}}\n"
 
         if self.label is not None:
@@ -461,8 +722,8 @@ class AbstractCodeBlock(LaTeXBlock):
             end_index = find_next_index(
                 lines, lambda line: line.startswith("```"), index + 1
             )
-            raw_lines = lines[index + 1 : end_index]
-            return instance_class("\n".join(raw_lines), language), end_index
+            raw_content = join_lines(lines, index + 1, end_index)
+            return instance_class(raw_content, language), end_index
 
         return None
 
@@ -476,7 +737,30 @@ class RawLaTeXBlock(AbstractCodeBlock):
 
 
 class TikZBlock(AbstractCodeBlock):
+    def prepare(self, **kwargs):
+        tikz_compiler = kwargs.get("tikz_compiler", None)
+
+        if tikz_compiler is not None:
+            tikz_compiler.submit(self.content, kwargs.get("hooks", None))
+
     def formatted_text(self, **kwargs):
+        tikz_compiler = kwargs.get("tikz_compiler", None)
+
+        # If externalized, the picture is included from the compiled PDF
+        if tikz_compiler is not None:
+            try:
+                pdf_path = tikz_compiler.compile(
+                    self.content, kwargs.get("hooks", None)
+                )
+            except ValueError as error:
+                raise ValueError(f"{error} ({self.location})") from error
+            except OSError as error:
+                raise type(error)(f"{error} ({self.location})") from error
+            except subprocess.SubprocessError as error:
+                raise ValueError(f"{error} ({self.location})") from error
+
+            return f"\\includegraphics{{{pdf_path.resolve()}}}"
+
         self.content = self.content.replace("\\begin{document}", "")
         self.content = self.content.replace("\\end{document}", "")
         self.content = re.sub(r"\\usepackage.*\n", "", self.content)
@@ -0,0 +1,88 @@
+import threading
+from pathlib import Path
+from typing import List, Optional, Sequence, Set
+
+from obsitex.cache import LRUCache
+from obsitex.constants import MAX_SCANNED_NOTES_BYTES
+from obsitex.parser.blocks import LaTeXBlock
+from obsitex.planner import ExecutionPlan
+from obsitex.planner.jobs import PlannedJob
+from obsitex.problems import Problem
+
+
+class ConversionCancelled(Exception):
+    pass
+
+
+class ConversionContext:
+    # State of a single conversion, kept apart from the parser so that one
+    # parser can run many conversions at once
+    def __init__(self, plan: ExecutionPlan, initial_hlevel: int):
+        self.plan = plan
+
+        # Blocks parsed so far, only kept if the conversion needs them
+        self.blocks: List[LaTeXBlock] = []
+
+        # Files read by the blocks when rendered, e.g.: figures
+        self.dependencies: Set[Path] = set()
+
+        # Flag to continuously check if in appendix
+        self.in_appendix = False
+
+        # Keep track of the latest header level
+        self.latest_parsed_hlevel = initial_hlevel
+
+        # Keys cited by the notes, starting with those found while planning,
+        # streamed files add theirs while parsed, without changing the plan
+        self.citation_keys: Set[str] = set(plan.citation_keys) if plan else set()
+
+        # Scans of the notes of lazy jobs, so that a note split around embeds
+        # is read once for all its pieces
+        self.scanned_notes = LRUCache(
+            "scanned notes", max_bytes=MAX_SCANNED_NOTES_BYTES
+        )
+
+        # Contents of the BibTeX file with the cited entries, if any
+        self.bibtex: Optional[str] = None
+
+        # If set, blocks that can't be detected are reported here instead of
+        # raising, e.g.: when checking a vault
+        self.problems: Optional[List[Problem]] = None
+
+        # If set, e.g.: from another thread, the conversion stops at the next
+        # job or block
+        self.cancel_event: Optional[threading.Event] = None
+
+    def check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ConversionCancelled("Conversion was cancelled.")
+
+    def job_configs(self, job: PlannedJob) -> dict:
+        # Jobs after the start of the appendix are marked as such, without
+        # changing the planned jobs
+        if self.in_appendix and not job.is_in_appendix:
+            return dict(job.configs, appendix=True)
+
+        return job.configs
+
+
+class ConversionResult:
+    def __init__(
+        self,
+        latex: str,
+        bibtex: Optional[str],
+        blocks: Sequence[LaTeXBlock],
+        dependencies: Set[Path],
+        citation_keys: Set[str],
+    ):
+        self.latex = latex
+
+        # Contents of the BibTeX file, None if there are no citations
+        self.bibtex = bibtex
+
+        self.blocks = blocks
+        self.dependencies = dependencies
+        self.citation_keys = citation_keys
+
+    def __repr__(self):
+        return f"ConversionResult(blocks={len(self.blocks)}, bibtex={self.bibtex is not None})"
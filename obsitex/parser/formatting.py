@@ -1,6 +1,13 @@
-import copy
 import re
-from typing import Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from obsitex.cache import MISSING, current_cache_manager
+from obsitex.constants import (
+    MAX_FORMATTED_LINE_LENGTH,
+    MAX_STREAM_CHUNK_LINES,
+    STREAM_CHUNK_LINES,
+)
+from obsitex.planner.transclusion import BLOCK_ID_REGEX
 
 LATEX_SPECIAL_CHARS = r"$%_}&#{"
 
@@ -12,6 +19,83 @@ def find_next_index(lst, expr, start=0):
     return len(lst)
 
 
+# Lists, quotes and callouts continue while their lines are of the same kind
+CONTINUED_LINE_REGEXES = [re.compile(r"-\s+"), re.compile(r"\d+\.\s+"), re.compile(">")]
+
+
+def continues_block(previous_line: str, line: str) -> bool:
+    return any(
+        regex.match(previous_line) is not None and regex.match(line) is not None
+        for regex in CONTINUED_LINE_REGEXES
+    )
+
+
+def iter_block_chunks(
+    lines: Iterable[str],
+    chunk_lines: int = STREAM_CHUNK_LINES,
+    max_chunk_lines: int = MAX_STREAM_CHUNK_LINES,
+) -> Iterator[Tuple[int, List[str], bool]]:
+    # Groups lines into chunks that no block can span, i.e.: chunks end before
+    # a line that follows a blank line, or once they have chunk_lines before
+    # any line that doesn't continue a list, quote or callout, unless inside an
+    # equation or code block. Each chunk is yielded with the index of its first
+    # line, and whether its lines must be kept as plain text
+    chunk: List[str] = []
+    chunk_index = 0
+    open_marker, fence_start = None, 0
+    leading = True
+
+    for line_index, line in enumerate(lines):
+        if leading and line.strip() == "":
+            # Leading blank lines are ignored, same as stripping the text
+            chunk_index += 1
+            continue
+
+        leading = False
+
+        if open_marker is None:
+            if len(chunk) > 0 and line.strip() != "":
+                previous_line = chunk[-1]
+
+                if previous_line.strip() == "" or (
+                    len(chunk) >= chunk_lines
+                    and not continues_block(previous_line, line)
+                ):
+                    yield chunk_index, chunk, False
+                    chunk, chunk_index = [], line_index
+
+            if line.startswith("```"):
+                open_marker, fence_start = "```", len(chunk)
+            elif line.startswith("$$"):
+                open_marker, fence_start = "$$", len(chunk)
+        elif line.startswith(open_marker):
+            open_marker = None
+
+        chunk.append(line)
+
+        # Bounds the lines kept in memory, e.g.: for files without blank
+        # lines, a fence still open by then is most likely unclosed, and its
+        # lines are kept as plain text instead of swallowing the file
+        if len(chunk) >= max_chunk_lines:
+            if open_marker is not None:
+                if fence_start > 0:
+                    yield chunk_index, chunk[:fence_start], False
+
+                yield chunk_index + fence_start, chunk[fence_start:], True
+                open_marker = None
+            else:
+                yield chunk_index, chunk, False
+
+            chunk, chunk_index = [], line_index + 1
+
+    # Trailing blank lines are ignored, same as stripping the text
+    while len(chunk) > 0 and chunk[-1].strip() == "":
+        chunk.pop()
+
+    if len(chunk) > 0:
+        yield chunk_index, chunk, False
+
+
 def detect_command(line) -> Optional[str]:
     match = re.match(r"\%\%\s*(.*)\s*\%\%", line)
     command = None
@@ -22,79 +106,261 @@ def detect_command(line) -> Optional[str]:
     return command
 
 
+CITATION_OPENING = "[[@"
+CITATION_CLOSING = "]]"
+
+# Citations are grouped if separated by commas and whitespace, or by nothing
+CITATION_SEPARATOR_REGEX = re.compile(r"\s*,[\s,]*")
+
+# Placeholders for contents that must not be escaped or formatted
+EQUATION_PLACEHOLDER = "<EQ-PLACEHOLDER>"
+LINK_PLACEHOLDER = "<LINK-PLACEHOLDER>"
+CODE_PLACEHOLDER = "<CODE-PLACEHOLDER>"
+
+FIGURE_REFERENCE_REGEX = re.compile(r"`(fig:\S*?)`")
+EQUATION_REFERENCE_REGEX = re.compile(r"`(eq:\S*?)`")
+ALGORITHM_REFERENCE_REGEX = re.compile(r"`(alg:\S*?)`")
+MONOSPACE_REGEX = re.compile(r"`(.*?)`")
+TEXTQUOTE_REGEX = re.compile(r'(?<!\*)\*"([^\*].*?)"\*(?!\*)')
+ITALIC_REGEX = re.compile(r"(?<!\*)\*([^\*].*?)\*(?!\*)")
+BOLD_REGEX = re.compile(r"\*\*([^\*].*?)\*\*")
+HIGHLIGHT_REGEX = re.compile(r"==([^=].*?)==")
+
+
+def iter_citations(text: str) -> Iterator[Tuple[int, int, str]]:
+    # Same as finding all r"\[\[@([^\]]+)\]\]", but each character is only
+    # looked at once, yields the bounds and key of each citation
+    position = 0
+
+    while True:
+        start = text.find(CITATION_OPENING, position)
+
+        if start == -1:
+            return
+
+        # Keys can't contain "]", so the key ends at the next one
+        close = text.find("]", start + len(CITATION_OPENING))
+
+        if close == -1:
+            return
+
+        if close > start + len(CITATION_OPENING) and text.startswith(
+            CITATION_CLOSING, close
+        ):
+            yield start, close + len(CITATION_CLOSING), text[
+                start + len(CITATION_OPENING) : close
+            ]
+            position = close + len(CITATION_CLOSING)
+        else:
+            # Any citation opened before this "]" would also end in it
+            position = close + 1
+
+
 # Function to group citations and replace
 def replace_adjacent_citations(text):
-    # Regex pattern to match adjacent citations
-    pattern_adjacent = r"(\[\[@[^\]]+?\]\](\s*,\s*)*)*\[\[@[^\]]+?\]\]"
+    pieces: List[str] = []
+    group: List[str] = []
+    piece_start = 0
+
+    # Group adjacent citations, e.g.: [[@a]], [[@b]] is replaced by \citep{a,b}
+    for start, end, key in iter_citations(text):
+        separator = text[piece_start:start]
+
+        if len(group) > 0 and (
+            separator == "" or CITATION_SEPARATOR_REGEX.fullmatch(separator)
+        ):
+            group.append(key)
+        else:
+            if len(group) > 0:
+                pieces.append(f"\\citep{{{','.join(group)}}}")
+
+            pieces.append(separator)
+            group = [key]
+
+        piece_start = end
+
+    if len(group) > 0:
+        pieces.append(f"\\citep{{{','.join(group)}}}")
+
+    pieces.append(text[piece_start:])
+
+    return "".join(pieces)
+
+
+def find_delimited(line: str, opening: str, closing: str) -> List[Tuple[int, int]]:
+    # Same as finding all re.escape(opening) + ".*?" + re.escape(closing) on a
+    # line without newlines, returns the bounds of each match
+    bounds = []
+    position = 0
 
-    # Find all matches for adjacent citations
-    matches = re.finditer(pattern_adjacent, text)
+    while True:
+        start = line.find(opening, position)
 
-    # Process each match
-    for match in matches:
-        # Extract the full matched string (group of adjacent citations)
-        full_match = match.group(0)
+        if start == -1:
+            return bounds
 
-        # Extract individual citations and combine them
-        citations = re.findall(r"\[\[@([^\]]+?)\]\]", full_match)
-        combined_citations = ",".join(citations)
+        # If there's no closing after this opening, there's none after the
+        # next ones either
+        end = line.find(closing, start + len(opening))
 
-        # Replace the full matched string with the combined citations
-        text = text.replace(full_match, f"\\citep{{{combined_citations}}}")
+        if end == -1:
+            return bounds
 
-    return text
+        position = end + len(closing)
+        bounds.append((start, position))
+
+
+def replace_delimited(line: str, opening: str, closing: str, placeholder: str) -> str:
+    pieces = []
+    position = 0
+
+    for start, end in find_delimited(line, opening, closing):
+        pieces.append(line[position:start])
+        pieces.append(placeholder)
+        position = end
+
+    pieces.append(line[position:])
+
+    return "".join(pieces)
+
+
+def restore_placeholders(line: str, placeholder: str, contents: List[str]) -> str:
+    # Replaces the first occurrences of the placeholder, in order
+    if len(contents) == 0:
+        return line
+
+    pieces = line.split(placeholder, len(contents))
+    restored = [pieces[0]]
+
+    for content, piece in zip(contents, pieces[1:]):
+        restored.append(content)
+        restored.append(piece)
+
+    return "".join(restored)
+
+
+def group_square_brackets(line: str) -> str:
+    # Same as re.sub(r"(?<!\[)(\[.*])(?!])", r"{\1}", line) on a line without
+    # newlines, the match goes from the first "[" to the last "]"
+    start = line.find("[")
+    end = line.rfind("]")
+
+    if start == -1 or end < start:
+        return line
+
+    return f"{line[:start]}{{{line[start : end + 1]}}}{line[end + 1 :]}"
+
+
+def sub_until_last(
+    pattern: re.Pattern, replacement: str, line: str, closing_end: int
+) -> str:
+    # Matches can't end after the last closing delimiter, so the pattern is
+    # only applied up to it, which keeps unclosed openings from being scanned
+    # until the end of the line over and over
+    if closing_end <= 0:
+        return line
+
+    return pattern.sub(replacement, line[:closing_end]) + line[closing_end:]
+
+
+def find_textquote_end(line: str) -> int:
+    # End of the last '"*' not followed by "*", or -1 if there's none
+    end = line.rfind('"*')
+
+    while end != -1 and line.startswith("*", end + 2):
+        end = line.rfind('"*', 0, end)
+
+    return end + 2 if end != -1 else -1
+
+
+def find_closing_end(line: str, closing: str) -> int:
+    end = line.rfind(closing)
+    return end + len(closing) if end != -1 else -1
+
+
+def format_line(line: str) -> str:
+    # Patterns don't match across lines, so lines with newlines are
+    # formatted one piece at a time
+    if "\n" in line:
+        return "\n".join(format_line(piece) for piece in line.split("\n"))
+
+    if len(line) > MAX_FORMATTED_LINE_LENGTH:
+        raise ValueError(
+            f"Line starting with {line[:40]!r} has {len(line)} characters, "
+            f"which is over the limit of {MAX_FORMATTED_LINE_LENGTH}."
+        )
+
+    # Block ids, e.g.: "Some text ^key-step", only point embeds to the line
+    if "^" in line:
+        block_id_match = BLOCK_ID_REGEX.search(line)
+
+        if block_id_match is not None:
+            line = line[: block_id_match.start()].rstrip()
+
+    # ===== SPECIAL CHARACTERS =====
+    # Extract and replace by placeholders equations and links before making formatting
+    equations = [line[start:end] for start, end in find_delimited(line, "$", "$")]
+    links = [line[start:end] for start, end in find_delimited(line, "[[", "]]")]
+    codes = [line[start:end] for start, end in find_delimited(line, "`", "`")]
+    line = replace_delimited(line, "$", "$", EQUATION_PLACEHOLDER)
+    line = replace_delimited(line, "[[", "]]", LINK_PLACEHOLDER)
+    line = replace_delimited(line, "`", "`", CODE_PLACEHOLDER)
+    # Format special chars that need to be escaped
+    for special_char in LATEX_SPECIAL_CHARS:
+        line = line.replace(special_char, f"\\{special_char}")
+    # Put square brackets in a group so that they are not parsed in latex as block arguments
+    line = group_square_brackets(line)
+    # put back equations and links
+    line = restore_placeholders(line, LINK_PLACEHOLDER, links)
+    line = restore_placeholders(line, EQUATION_PLACEHOLDER, equations)
+    line = restore_placeholders(line, CODE_PLACEHOLDER, codes)
+
+    # Replace Markdown figure references by Latex references
+    line = FIGURE_REFERENCE_REGEX.sub(r"\\autoref{\1}", line)
+    # Replace Markdown equation references by Latex references
+    line = EQUATION_REFERENCE_REGEX.sub(r"\\autoref{\1}", line)
+    # Replace the markdown algorithm references by Latex references
+    line = ALGORITHM_REFERENCE_REGEX.sub(r"\\autoref{\1}", line)
+
+    # ===== TEXT FORMATTING =====
+    # Replace Markdown monospace by latex monospace (note: do after other code blocks like refs and citations)
+    line = MONOSPACE_REGEX.sub(r"\\texttt{\1}", line)
+    # Replace Markdown italics with quote marks by Latex text quote
+    line = sub_until_last(
+        TEXTQUOTE_REGEX, r"\\textquote{\1}", line, find_textquote_end(line)
+    )
+    # Replace Markdown italics by Latex italics
+    line = sub_until_last(
+        ITALIC_REGEX, r"\\textit{\1}", line, find_closing_end(line, "*")
+    )
+    # Replace Markdown bold by Latex bold
+    line = sub_until_last(
+        BOLD_REGEX, r"\\textbf{\1}", line, find_closing_end(line, "**")
+    )
+    # Replace Markdown highlight by Latex highlight
+    line = sub_until_last(
+        HIGHLIGHT_REGEX, r"\\hl{\1}", line, find_closing_end(line, "==")
+    )
+
+    return line
 
 
 def format_text(text_lines_origin):
     # Inspired by Alejandro Daniel Noel
     # In his code https://github.com/adanielnoel/Obsidian-to-latex/blob/master/parser_utils.py
     # Modified by me to fit the needs of this project
-    text_lines = copy.deepcopy(text_lines_origin)
-
-    for i in range(len(text_lines)):
-        # ===== SPECIAL CHARACTERS =====
-        # Extract and replace by placeholders equations and links before making formatting
-        equations = re.findall(r"\$.*?\$", text_lines[i])
-        links = re.findall(r"\[\[.*?]]", text_lines[i])
-        codes = re.findall(r"`.*?`", text_lines[i])
-        text_lines[i] = re.sub(r"\$.*?\$", "<EQ-PLACEHOLDER>", text_lines[i])
-        text_lines[i] = re.sub(r"\[\[.*?]]", "<LINK-PLACEHOLDER>", text_lines[i])
-        text_lines[i] = re.sub(r"`.*?`", "<CODE-PLACEHOLDER>", text_lines[i])
-        # Format special chars that need to be escaped
-        for special_char in LATEX_SPECIAL_CHARS:
-            text_lines[i] = text_lines[i].replace(special_char, f"\\{special_char}")
-        # Put square brackets in a group so that they are not parsed in latex as block arguments
-        text_lines[i] = re.sub(r"(?<!\[)(\[.*])(?!])", r"{\1}", text_lines[i])
-        # put back equations and links
-        for link in links:
-            text_lines[i] = text_lines[i].replace(r"<LINK-PLACEHOLDER>", link, 1)
-        for equation in equations:
-            text_lines[i] = text_lines[i].replace(r"<EQ-PLACEHOLDER>", equation, 1)
-        for code in codes:
-            text_lines[i] = text_lines[i].replace(r"<CODE-PLACEHOLDER>", code, 1)
-
-        # Replace Markdown figure references by Latex references
-        text_lines[i] = re.sub(r"`(fig:\S*?)`", r"\\autoref{\1}", text_lines[i])
-        # Replace Markdown equation references by Latex references
-        text_lines[i] = re.sub(r"`(eq:\S*?)`", r"\\autoref{\1}", text_lines[i])
-        # Replace the markdown algorithm references by Latex references
-        text_lines[i] = re.sub(r"`(alg:\S*?)`", r"\\autoref{\1}", text_lines[i])
-
-        # ===== TEXT FORMATTING =====
-        # Replace Markdown monospace by latex monospace (note: do after other code blocks like refs and citations)
-        text_lines[i] = re.sub(r"`(.*?)`", r"\\texttt{\1}", text_lines[i])
-        # Replace Markdown italics with quote marks by Latex text quote
-        text_lines[i] = re.sub(
-            r'(?<!\*)\*"([^\*].*?)"\*(?!\*)', r"\\textquote{\1}", text_lines[i]
-        )
-        # Replace Markdown italics by Latex italics
-        text_lines[i] = re.sub(
-            r"(?<!\*)\*([^\*].*?)\*(?!\*)", r"\\textit{\1}", text_lines[i]
-        )
-        # Replace Markdown bold by Latex bold
-        text_lines[i] = re.sub(r"\*\*([^\*].*?)\*\*", r"\\textbf{\1}", text_lines[i])
-        # Replace Markdown highlight by Latex highlight
-        text_lines[i] = re.sub(r"==([^=].*?)==", r"\\hl{\1}", text_lines[i])
-        text_lines[i] = replace_adjacent_citations(text_lines[i])
+    cache = current_cache_manager().namespace("formatted lines")
+    formatted_lines = []
+
+    # Formatting is pure, thus repeated lines, e.g.: of documents converted
+    # again, are formatted once
+    for line in text_lines_origin:
+        formatted_line = cache.get(line)
+
+        if formatted_line is MISSING:
+            formatted_line = replace_adjacent_citations(format_line(line))
+            cache.put(line, formatted_line, size=len(line) + len(formatted_line))
+
+        formatted_lines.append(formatted_line)
 
-    return text_lines
+    return formatted_lines
@@ -0,0 +1,151 @@
+import re
+from array import array
+from typing import Iterator, Sequence, Tuple, Union
+
+NEWLINE_REGEX = re.compile("\n")
+
+
+class SourceLines(Sequence[str]):
+    # Lines of a note as offsets over a single buffer, substrings are only
+    # created when a line is accessed, and slices are views over the buffer
+    def __init__(self, text: str):
+        self.text = text
+
+        # Offset where each line starts, plus the end of the buffer as if
+        # it had a trailing newline
+        self._line_starts = array("q", [0])
+        self._line_starts.extend(match.end() for match in NEWLINE_REGEX.finditer(text))
+        self._line_starts.append(len(text) + 1)
+        self._n_lines = len(self._line_starts) - 1
+
+        # Detectors look at the same line several times, keep the last one
+        self._cached_index, self._cached_line = None, ""
+
+    def __len__(self) -> int:
+        return self._n_lines
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return SourceSpan(self, *_slice_bounds(index, self._n_lines))
+
+        # Negative indices are cached as the line they point to
+        line_index = index + self._n_lines if index < 0 else index
+
+        if line_index == self._cached_index:
+            return self._cached_line
+
+        if not 0 <= line_index < self._n_lines:
+            raise IndexError(f"Line {index} out of range for {self._n_lines} lines")
+
+        line_starts = self._line_starts
+        line = self.text[line_starts[line_index] : line_starts[line_index + 1] - 1]
+        self._cached_index, self._cached_line = line_index, line
+
+        return line
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def line_offsets(self, index: int) -> Tuple[int, int]:
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError(f"Line {index} out of range for {len(self)} lines")
+
+        # The end offset excludes the newline
+        return self._line_starts[index], self._line_starts[index + 1] - 1
+
+    def join(self, start: int, stop: int) -> str:
+        # Same as "\n".join(lines[start:stop]), but taken as one slice
+        start, stop = max(start, 0), min(stop, len(self))
+
+        if start >= stop:
+            return ""
+
+        return self.text[self._line_starts[start] : self._line_starts[stop] - 1]
+
+    def __repr__(self):
+        return f"SourceLines({list(self)})"
+
+
+class SourceSpan(Sequence[str]):
+    # Range of lines of a source, without copying them
+    def __init__(self, source: SourceLines, start: int, stop: int):
+        self.source = source
+        self.start = start
+        self.stop = max(start, stop)
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            start, stop = _slice_bounds(index, len(self))
+            return SourceSpan(self.source, self.start + start, self.start + stop)
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError(f"Line {index} out of range for {len(self)} lines")
+
+        return self.source[self.start + index]
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self.start, self.stop):
+            yield self.source[index]
+
+    def join(self, start: int, stop: int) -> str:
+        start, stop = max(start, 0), min(stop, len(self))
+        return self.source.join(self.start + start, self.start + stop)
+
+    @property
+    def text(self) -> str:
+        return self.source.join(self.start, self.stop)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class MappedLines(Sequence[str]):
+    # Lines with a regex substitution applied lazily, when each line is
+    # accessed, e.g.: to remove list or quote markers
+    def __init__(self, lines: Sequence[str], pattern: str, replacement: str):
+        self.lines = lines
+        self.pattern = pattern
+        self.replacement = replacement
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return MappedLines(self.lines[index], self.pattern, self.replacement)
+
+        return re.sub(self.pattern, self.replacement, self.lines[index])
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self.lines:
+            yield re.sub(self.pattern, self.replacement, line)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def join_lines(lines: Sequence[str], start: int, stop: int) -> str:
+    # Joins a range of lines, without copies if the lines are over a buffer
+    if isinstance(lines, (SourceLines, SourceSpan)):
+        return lines.join(start, stop)
+
+    return "\n".join(lines[start:stop])
+
+
+def _slice_bounds(index: slice, length: int) -> Tuple[int, int]:
+    start, stop, step = index.indices(length)
+
+    if step != 1:
+        raise ValueError("Lines can only be sliced with a step of 1.")
+
+    return start, max(start, stop)
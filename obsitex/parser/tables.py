@@ -0,0 +1,216 @@
+import csv
+import json
+import os
+import re
+import time
+from io import StringIO
+from itertools import chain, islice
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Union
+
+from obsitex.cache import MISSING, current_cache_manager
+from obsitex.events import CACHE_LOOKUP, EventHooks
+from obsitex.filesystem import FileSystem
+from obsitex.parser.formatting import LATEX_SPECIAL_CHARS
+
+# Delimiters of the supported data files, by extension
+TABLE_DELIMITERS = {".csv": ",", ".tsv": "\t"}
+
+TABLE_EMBED_REGEX = re.compile(
+    r"\s*\!\[\[([^\]|]+\.(?:csv|tsv))(?:\|[^\]]*)?\]\]", re.IGNORECASE
+)
+
+# Configurations of the callout that change the rows read from the file
+TABLE_ROW_OPTIONS = ("columns", "format", "max_rows", "delimiter", "header")
+
+LATEX_ESCAPES = str.maketrans({char: f"\\{char}" for char in LATEX_SPECIAL_CHARS})
+
+
+def find_table_source(lines: Sequence[str], configs: Optional[dict]) -> Optional[str]:
+    # Data files are either embedded as the first line of the callout, or set
+    # in the configurations, in which case the path is kept as is
+    if isinstance(configs, dict) and configs.get("source") is not None:
+        return str(configs["source"])
+
+    if len(lines) > 0:
+        match = TABLE_EMBED_REGEX.match(lines[0])
+
+        if match is not None:
+            return match.group(1).split("/")[-1]
+
+    return None
+
+
+class TableRows:
+    def __init__(
+        self, header: Optional[List[str]], body: str, n_rows: int, n_columns: int
+    ):
+        # Cells of the header, already escaped, None if the file has no header
+        self.header = header
+
+        # Rows in LaTeX, each ending in \\
+        self.body = body
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+
+
+def escape_cell(value: str) -> str:
+    return value.strip().translate(LATEX_ESCAPES)
+
+
+def format_cell(value: str, spec: Optional[str]) -> str:
+    # Numbers are formatted with the spec, e.g.: ".2f", other values are kept
+    if spec is not None:
+        try:
+            return escape_cell(format(float(value), spec))
+        except ValueError:
+            pass
+
+    return escape_cell(value)
+
+
+def select_columns(
+    header: Optional[List[str]],
+    columns: Optional[Sequence[Union[str, int]]],
+    n_columns: int,
+) -> Optional[List[int]]:
+    # Indices are checked against the columns of the header, or of the first
+    # row if there is no header
+    if columns is None:
+        return None
+    elif isinstance(columns, (str, int)):
+        columns = [columns]
+
+    indices = []
+
+    for column in columns:
+        if isinstance(column, int):
+            if not 0 <= column < n_columns:
+                raise ValueError(
+                    f"Column {column} out of range, the table has {n_columns} columns"
+                )
+
+            indices.append(column)
+        elif header is not None and column in header:
+            indices.append(header.index(column))
+        else:
+            raise ValueError(f"Column {column} not found in table header {header}")
+
+    return indices
+
+
+def iter_table_cells(
+    rows: Iterator[List[str]], indices: Optional[List[int]]
+) -> Iterator[List[str]]:
+    for row in rows:
+        if indices is None:
+            yield row
+        else:
+            yield [row[index] if index < len(row) else "" for index in indices]
+
+
+def read_table_rows(file, configs: dict, suffix: str) -> TableRows:
+    # Rows are read and converted one at a time, only the LaTeX is kept
+    delimiter = configs.get("delimiter", TABLE_DELIMITERS.get(suffix, ","))
+    reader = csv.reader(file, delimiter=delimiter)
+
+    header = None
+
+    if configs.get("header", True):
+        header = next(reader, None)
+        first_row = header
+    else:
+        first_row = next(reader, None)
+
+        if first_row is not None:
+            reader = chain([first_row], reader)
+
+    indices = select_columns(
+        header,
+        configs.get("columns", None),
+        len(first_row) if first_row is not None else 0,
+    )
+
+    if header is not None and indices is not None:
+        header = [header[index] for index in indices]
+
+    # Numeric format, either one for all columns or by column name
+    formats = configs.get("format", None)
+
+    if isinstance(formats, dict):
+        names = header if header is not None else []
+        column_formats = [formats.get(name, None) for name in names]
+    else:
+        column_formats = None
+
+    max_rows = configs.get("max_rows", None)
+    rows = iter_table_cells(reader, indices)
+
+    if max_rows is not None:
+        rows = islice(rows, max_rows)
+
+    body, n_rows = StringIO(), 0
+    n_columns = len(header) if header is not None else 0
+
+    for cells in rows:
+        if column_formats is not None:
+            cells = [
+                (
+                    format_cell(cell, column_formats[index])
+                    if index < len(column_formats)
+                    else escape_cell(cell)
+                )
+                for index, cell in enumerate(cells)
+            ]
+        else:
+            cells = [format_cell(cell, formats) for cell in cells]
+
+        body.write(" & ".join(cells))
+        body.write(" \\\\\n")
+        n_rows += 1
+        n_columns = max(n_columns, len(cells))
+
+    if header is not None:
+        header = [escape_cell(cell) for cell in header]
+
+    return TableRows(header, body.getvalue(), n_rows, n_columns)
+
+
+def load_table_rows(
+    path: Path,
+    filesystem: FileSystem,
+    configs: dict,
+    hooks: Optional[EventHooks] = None,
+) -> TableRows:
+    # Tables are cached by their path and the options that change the rows,
+    # until the file changes, only files with a known modification time are
+    # cached, as notes are, e.g.: not those of archives
+    start = time.perf_counter()
+    mtime = filesystem.mtime(path)
+    options = {key: configs.get(key, None) for key in TABLE_ROW_OPTIONS}
+    key = (
+        os.path.abspath(path),
+        json.dumps([path.suffix, options], sort_keys=True, default=str),
+    )
+    cache = current_cache_manager().namespace("external tables")
+    rows = cache.get(key, mtime) if mtime is not None else MISSING
+    rows_cached = rows is not MISSING
+
+    if not rows_cached:
+        with filesystem.open_text(path, newline="") as file:
+            rows = read_table_rows(file, configs, path.suffix.lower())
+
+        if mtime is not None:
+            cache.put(key, rows, size=len(rows.body), path=path, mtime=mtime)
+
+    if hooks is not None and hooks.enabled:
+        hooks.emit(
+            CACHE_LOOKUP,
+            start,
+            time.perf_counter(),
+            cache="external tables",
+            hit=rows_cached,
+            path=path,
+        )
+
+    return rows
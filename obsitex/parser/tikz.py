@@ -0,0 +1,182 @@
+import hashlib
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from obsitex.events import CACHE_LOOKUP, EventHooks
+
+# Must write a PDF named after the input, next to it, {input} is replaced by
+# the path of the standalone document and the command runs in its folder
+DEFAULT_TIKZ_COMMAND = "pdflatex -interaction=nonstopmode -halt-on-error {input}"
+
+TIKZ_PREAMBLE_REGEX = re.compile(r"\\(?:usepackage|usetikzlibrary).*\n?")
+
+# Lines of the command output shown when the compilation fails
+TIKZ_ERROR_CONTEXT = 20
+
+
+def split_tikz_source(content: str) -> Tuple[str, str]:
+    # Packages and libraries go to the preamble of the standalone document,
+    # the rest is the picture itself
+    packages = "".join(
+        line if line.endswith("\n") else f"{line}\n"
+        for line in TIKZ_PREAMBLE_REGEX.findall(content)
+    )
+    body = TIKZ_PREAMBLE_REGEX.sub("", content)
+    body = body.replace("\\begin{document}", "").replace("\\end{document}", "")
+
+    return packages, body.strip()
+
+
+class TikZCompiler:
+    # Compiles TikZ blocks to standalone PDFs, cached by the hash of the
+    # document and command, thus unchanged pictures are never compiled again
+    def __init__(
+        self,
+        cache_dir: Path,
+        command: str = DEFAULT_TIKZ_COMMAND,
+        preamble: str = "",
+        max_workers: Optional[int] = None,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.command = command
+        self.preamble = preamble
+
+        # Compilations run in external processes, threads are enough to wait
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="obsitex-tikz"
+        )
+        self._futures: Dict[str, "Future[Path]"] = {}
+        self._lock = threading.Lock()
+
+    def standalone_document(self, content: str) -> str:
+        packages, body = split_tikz_source(content)
+        preamble = self.preamble
+
+        if len(preamble) > 0 and not preamble.endswith("\n"):
+            preamble += "\n"
+
+        return (
+            "\\documentclass{standalone}\n"
+            "\\usepackage{tikz}\n"
+            f"{preamble}{packages}"
+            "\\begin{document}\n"
+            f"{body}\n"
+            "\\end{document}\n"
+        )
+
+    def cache_key(self, document: str) -> str:
+        sha256 = hashlib.sha256()
+        sha256.update(self.command.encode("utf-8"))
+        sha256.update(b"\0")
+        sha256.update(document.encode("utf-8"))
+        return sha256.hexdigest()
+
+    def submit(
+        self, content: str, hooks: Optional[EventHooks] = None
+    ) -> "Future[Path]":
+        # Pictures are compiled at most once at a time, even if submitted many
+        # times, compiled pictures are then found in the cache folder
+        start = time.perf_counter()
+        document = self.standalone_document(content)
+        key = self.cache_key(document)
+
+        with self._lock:
+            future = self._futures.get(key, None)
+            submitted = future is None
+
+            if submitted:
+                output_path = self.cache_dir / f"{key}.pdf"
+
+                if output_path.is_file():
+                    future = Future()
+                    future.set_result(output_path)
+                else:
+                    future = self._executor.submit(self._compile, document, output_path)
+                    self._futures[key] = future
+
+                # Lookups that wait for a running compilation aren't reported
+                if hooks is not None and hooks.enabled:
+                    hooks.emit(
+                        CACHE_LOOKUP,
+                        start,
+                        time.perf_counter(),
+                        cache="tikz",
+                        hit=future.done(),
+                        path=output_path,
+                    )
+
+        # Only running compilations are kept, thus failed pictures are compiled
+        # again, e.g.: after fixing the preamble, outside the lock since the
+        # callback runs at once if the future is already done
+        if submitted:
+            future.add_done_callback(lambda done: self._forget(key, done))
+
+        return future
+
+    def _forget(self, key: str, future: "Future[Path]"):
+        with self._lock:
+            if self._futures.get(key, None) is future:
+                del self._futures[key]
+
+    def compile(self, content: str, hooks: Optional[EventHooks] = None) -> Path:
+        return self.submit(content, hooks).result()
+
+    def _command_args(self, input_path: Path):
+        args = shlex.split(self.command)
+
+        if not any("{input}" in arg for arg in args):
+            args.append("{input}")
+
+        return [arg.replace("{input}", str(input_path)) for arg in args]
+
+    def _compile(self, document: str, output_path: Path) -> Path:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Compiled in a folder of the cache, so that the PDF is moved in place
+        # atomically and partial outputs are never read
+        with tempfile.TemporaryDirectory(
+            prefix=".tikz-", dir=self.cache_dir
+        ) as work_dir:
+            input_path = Path(work_dir).resolve() / "picture.tex"
+            input_path.write_text(document)
+
+            try:
+                result = subprocess.run(
+                    self._command_args(input_path),
+                    cwd=work_dir,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                )
+            except (FileNotFoundError, PermissionError) as error:
+                raise ValueError(
+                    f"Could not run {self.command} to compile TikZ picture: {error}"
+                ) from error
+            pdf_path = input_path.with_suffix(".pdf")
+
+            if result.returncode != 0 or not pdf_path.is_file():
+                output_tail = "\n".join(
+                    result.stdout.splitlines()[-TIKZ_ERROR_CONTEXT:]
+                )
+                raise ValueError(
+                    f"Could not compile TikZ picture, {self.command} exited with code {result.returncode}:\n{output_tail}"
+                )
+
+            os.replace(pdf_path, output_path)
+
+        return output_path
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __repr__(self):
+        return f"TikZCompiler({self.cache_dir})"
@@ -1,32 +1,101 @@
+import asyncio
+import copy
 import logging
-import re
+import os
+import time
+from concurrent.futures import Executor
+from itertools import islice
 from pathlib import Path
-from typing import Optional, Sequence, Set, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
 import yaml
 
-from obsitex.planner.jobs import AddBibliography, AddHeader, AddText, PlannedJob
+from obsitex.cache import (
+    DEFAULT_CACHE_MANAGER,
+    MISSING,
+    CacheManager,
+    LRUCache,
+    current_cache_manager,
+)
+from obsitex.constants import DEFAULT_MAX_CONCURRENT_READS
+from obsitex.events import (
+    CACHE_LOOKUP,
+    JOB_PLANNED,
+    NOTE_READ,
+    NOTE_RELOADED,
+    EventHooks,
+)
+from obsitex.filesystem import LOCAL_FILESYSTEM, FileSystem
+from obsitex.problems import Problem
+from obsitex.planner.jobs import (
+    AddBibliography,
+    AddHeader,
+    AddText,
+    LoadText,
+    PlannedJob,
+    StreamText,
+)
 from obsitex.planner.links import find_all_citations, find_all_links
-from obsitex.utils import assure_dir, assure_file, read_file
+from obsitex.planner.outline import Outline, build_outline
+from obsitex.planner.scanner import FRONTMATTER_MARKER, ScannedNote, scan_note
+from obsitex.planner.transclusion import (
+    EMBED_LINE_REGEX,
+    MAX_EMBED_DEPTH,
+    NoteIndex,
+    parse_embed_target,
+)
+from obsitex.utils import assure_dir, assure_file, iter_file_lines, read_file
 
 
-def parse_yaml_properties(text: str) -> Tuple[str, dict]:
-    properties = {}
+def parse_yaml_properties(
+    frontmatter: Optional[str],
+    source: Path,
+    problems: Optional[List[Problem]] = None,
+    cache_manager: Optional[CacheManager] = None,
+) -> dict:
+    if frontmatter is None:
+        return {}
 
-    if text.startswith("---"):
-        # Find the end of the properties
-        end_properties = text.find("---", 3)
+    # Notes often share their properties, e.g.: templates, thus the parsed
+    # properties are cached by their text, and copied since callers update them
+    if cache_manager is None:
+        cache_manager = current_cache_manager()
 
-        # Remove the properties from the file contents
-        yaml_configs = text[3:end_properties]
+    cache = cache_manager.namespace("frontmatter")
+    properties = cache.get(frontmatter)
 
-        # Try to load the properties, if it doesn't work, ignore
-        properties = yaml.safe_load(yaml_configs)
+    if properties is not MISSING:
+        return copy.deepcopy(properties)
 
-        # Clean the props from the text
-        text = text[end_properties + 3 :].strip()
+    # Try to load the properties, if it doesn't work, ignore
+    try:
+        properties = yaml.safe_load(frontmatter)
+    except yaml.YAMLError as error:
+        logging.error(f"Error parsing YAML properties from {source}, ignoring...")
 
-    return text, properties
+        if problems is not None:
+            problems.append(Problem(source, 0, f"Invalid YAML properties: {error}"))
+
+        return {}
+
+    if not isinstance(properties, dict):
+        properties = {}
+
+    cache.put(frontmatter, properties, size=len(frontmatter))
+    return copy.deepcopy(properties)
+
+
+def iter_heading_lines(
+    text: str, headings: Sequence[Tuple[int, str, int]], first_line: int
+) -> Iterator[Tuple[int, str, int, int]]:
+    # Headings are in the order of their offsets, thus newlines are counted
+    # once between each heading and the next
+    line, previous_offset = first_line, 0
+
+    for level, title, offset in headings:
+        line += text.count("\n", previous_offset, offset)
+        previous_offset = offset
+        yield level, title, offset, line
 
 
 class ExecutionPlan:
@@ -34,29 +103,88 @@ class ExecutionPlan:
         self,
         bibtex_database_path: Optional[Path] = None,
         implictly_add_bibtex: bool = True,
+        hooks: Optional[EventHooks] = None,
+        filesystem: Optional[FileSystem] = None,
+        collect_problems: bool = False,
+        lazy: bool = False,
+        cache_manager: Optional[CacheManager] = None,
     ):
         self.bibtex_database_path = bibtex_database_path
         self.implictly_add_bibtex = implictly_add_bibtex
+        self.hooks = hooks if hooks is not None else EventHooks()
+
+        # Notes and the BibTeX database are read from here, e.g.: an archive
+        self.filesystem = filesystem if filesystem is not None else LOCAL_FILESYSTEM
 
         # Check that if the paths are provided, they are valid
-        assure_file(self.bibtex_database_path)
+        assure_file(self.bibtex_database_path, self.filesystem)
+
+        # If collecting, problems in the notes are kept here instead of raised,
+        # and the notes affected by them are skipped
+        self.problems: Optional[List[Problem]] = [] if collect_problems else None
+
+        # If lazy, text jobs keep the offsets of their text in the note instead
+        # of the text, which is read again just before being parsed
+        self.lazy = lazy
+
+        # Notes, their properties and indices are cached across plans, and
+        # invalidated when the notes change
+        self.cache_manager = (
+            cache_manager if cache_manager is not None else DEFAULT_CACHE_MANAGER
+        )
 
         # Variables to store extracted data
         self._citation_keys: Set[str] = set()
         self._n_files_read = 0
 
+        # Notes read while planning, in the order they were read
+        self.read_paths: List[Path] = []
+
+        # Header level the first note is parsed at, None for the parser's default
+        self.initial_hlevel: Optional[int] = None
+
+        # Embedded notes are indexed once, on their first embed, and looked up
+        # in the folders of the added files and dirs
+        self._note_indices: Dict[Path, NoteIndex] = {}
+        self._embed_roots: List[Path] = []
+
         # Used to specify the jobs that will run in the execution plan
         self._jobs: Sequence[PlannedJob] = []
+        self._n_headers = 0
+
+        # Outlines of the planned jobs, by initial header level
+        self._outlines: Dict[int, Outline] = {}
 
     @property
     def n_files_read(self) -> int:
         return self._n_files_read
 
+    @property
+    def citation_keys(self) -> Set[str]:
+        return self._citation_keys
+
     @property
     def num_headers(self) -> int:
-        return len([job for job in self._jobs if isinstance(job, AddHeader)])
+        return self._n_headers
+
+    def outline(self, base_hlevel: int = 0) -> Outline:
+        # Built once for the planned jobs, base_hlevel is used if the plan has
+        # no initial header level, as in the parser
+        initial_hlevel = (
+            self.initial_hlevel if self.initial_hlevel is not None else base_hlevel
+        )
+
+        if initial_hlevel not in self._outlines:
+            self._outlines[initial_hlevel] = build_outline(self._jobs, initial_hlevel)
+
+        return self._outlines[initial_hlevel]
+
+    def iter_jobs(self, citation_keys: Optional[Set[str]] = None):
+        # Citations of streamed files are added to the given keys while their
+        # jobs are parsed, which happens before the bibliography job is yielded
+        if citation_keys is None:
+            citation_keys = self._citation_keys
 
-    def iter_jobs(self):
         # Find the first job in the appendix
         appendix_job_idx = None
 
@@ -75,51 +203,428 @@ class ExecutionPlan:
         # When this is called, it's assumed that all files have been added
         # to the execution plan. Thus we need to check if we should add the bibliography
         # here or not. - should always be the last job
-        if self.implictly_add_bibtex and len(self._citation_keys) > 0:
-            if (
-                self.bibtex_database_path is None
-                or not self.bibtex_database_path.is_file()
+        if self.implictly_add_bibtex and len(citation_keys) > 0:
+            if self.bibtex_database_path is None or not self.filesystem.is_file(
+                self.bibtex_database_path
             ):
                 raise FileNotFoundError(
                     f"BibTeX database not found at {self.bibtex_database_path}, please provide a valid path if you're using citations."
                 )
 
-            add_bib_job = AddBibliography(
-                self._citation_keys, self.bibtex_database_path
-            )
+            add_bib_job = AddBibliography(set(citation_keys), self.bibtex_database_path)
             yield add_bib_job
 
-        for job in self._jobs[appendix_job_idx:]:
-            job.mark_as_appendix()
-            yield job
+        # Jobs after the start of the appendix are marked when parsed
+        yield from self._jobs[appendix_job_idx:]
+
+    def _read_note(self, file_path: Path) -> str:
+        self._n_files_read += 1
+        self.read_paths.append(file_path)
+
+        return self._cached_note("notes", file_path, self._load_note)
+
+    def _load_note(self, file_path: Path) -> str:
+        start = time.perf_counter()
+        file_contents = read_file(file_path, self.filesystem)
+
+        if self.hooks.enabled:
+            self.hooks.emit(
+                NOTE_READ,
+                start,
+                time.perf_counter(),
+                path=file_path,
+                bytes=len(file_contents),
+            )
+
+        return file_contents
+
+    def _cached_note(
+        self, namespace: str, file_path: Path, compute: Callable[[Path], Any]
+    ) -> Any:
+        # Only notes with a known modification time are cached, e.g.: not the
+        # notes of archives, nor those of lazy plans, which keep no text
+        mtime = self.filesystem.mtime(file_path) if not self.lazy else None
+
+        if mtime is None:
+            return compute(file_path)
+
+        start = time.perf_counter()
+        cache = self.cache_manager.namespace(namespace)
+        key = os.path.abspath(file_path)
+        value = cache.get(key, mtime)
+        hit = value is not MISSING
+
+        if not hit:
+            value = compute(file_path)
+            size = len(value.text) if isinstance(value, NoteIndex) else len(value)
+            cache.put(key, value, size=size, path=file_path, mtime=mtime)
+
+        if self.hooks.enabled:
+            self.hooks.emit(
+                CACHE_LOOKUP,
+                start,
+                time.perf_counter(),
+                cache=namespace,
+                hit=hit,
+                path=file_path,
+            )
+
+        return value
+
+    def _add_job(self, job: PlannedJob, start: float):
+        self._jobs.append(job)
+        self._outlines.clear()
+
+        if isinstance(job, AddHeader):
+            self._n_headers += 1
+
+        if self.hooks.enabled:
+            self.hooks.emit(
+                JOB_PLANNED,
+                start,
+                time.perf_counter(),
+                path=job.source_path,
+                job_class=job.__class__.__name__,
+            )
+
+    def _report(self, path: Optional[Path], message: str, line: Optional[int] = None):
+        if self.problems is None:
+            raise ValueError(message)
+
+        self.problems.append(Problem(path, line, message))
+
+    def _note_index(self, file_path: Path) -> NoteIndex:
+        if file_path not in self._note_indices:
+            # Read first, so the note is recorded even if its index is cached
+            text = self._read_note(file_path)
+            self._note_indices[file_path] = self._cached_note(
+                "note indices", file_path, lambda _: NoteIndex(text)
+            )
+
+        return self._note_indices[file_path]
+
+    def _resolve_embed(self, note: str, base_path: Path) -> Optional[Path]:
+        # Same folder as the embedding note, a subfolder named after the note,
+        # or relative to the root of the added files
+        name = note.split("/")[-1]
+        candidates = [base_path / f"{note}.md", base_path / note / f"{name}.md"]
+        candidates += [root_path / f"{note}.md" for root_path in self._embed_roots]
+
+        for candidate in candidates:
+            if self.filesystem.is_file(candidate):
+                return candidate
+
+        return None
+
+    def _add_text_jobs(
+        self,
+        scanned_note: ScannedNote,
+        source_path: Path,
+        properties: dict,
+        start: float,
+        strip_links: bool,
+        line_offset: int = 0,
+        embed_ancestors: Tuple[Tuple[Path, Optional[str], Optional[str]], ...] = (),
+        span: Optional[Tuple[int, int]] = None,
+    ):
+        # Text is split around the embeds of other notes, which are planned
+        # in place as jobs of the embedded note
+        text = scanned_note.text
+        piece_start, piece_line = 0, scanned_note.first_line + line_offset
+        in_fence = False
+
+        for match in EMBED_LINE_REGEX.finditer(text):
+            if match.group("fence") is not None:
+                in_fence = not in_fence
+                continue
+
+            embed = parse_embed_target(match.group("target"))
+
+            if in_fence or embed is None:
+                continue
+
+            embed_line = piece_line + text.count("\n", piece_start, match.start())
+            self._add_text_piece(
+                scanned_note,
+                (piece_start, match.start()),
+                piece_line,
+                source_path,
+                properties,
+                start,
+                strip_links,
+                span,
+            )
+            self._add_embed(
+                embed,
+                source_path,
+                embed_line,
+                properties,
+                start,
+                strip_links,
+                embed_ancestors,
+            )
+            piece_start, piece_line = match.end(), embed_line
+
+        if piece_start == 0:
+            # Notes without embeds are planned as a single job, as they are
+            self._add_text_job(
+                text,
+                scanned_note.headings,
+                piece_line,
+                source_path,
+                properties,
+                start,
+                (0, len(text)),
+                span,
+                strip_links,
+            )
+        else:
+            self._add_text_piece(
+                scanned_note,
+                (piece_start, len(text)),
+                piece_line,
+                source_path,
+                properties,
+                start,
+                strip_links,
+                span,
+            )
+
+    def _add_text_piece(
+        self,
+        scanned_note: ScannedNote,
+        piece: Tuple[int, int],
+        piece_line: int,
+        source_path: Path,
+        properties: dict,
+        start: float,
+        strip_links: bool,
+        span: Optional[Tuple[int, int]],
+    ):
+        piece_start, piece_end = piece
+        text = scanned_note.text[piece_start:piece_end]
+        stripped_text = text.strip()
+
+        if stripped_text == "":
+            return
+
+        # Offsets of the headings are relative to the stripped piece
+        leading_whitespace = len(text) - len(text.lstrip())
+        piece_line += text.count("\n", 0, leading_whitespace)
+        piece_start += leading_whitespace
+        headings = [
+            (level, title, offset - piece_start)
+            for level, title, offset in scanned_note.headings
+            if piece_start <= offset < piece_end
+        ]
+
+        self._add_text_job(
+            stripped_text,
+            headings,
+            piece_line,
+            source_path,
+            properties,
+            start,
+            piece,
+            span,
+            strip_links,
+        )
+
+    def _add_text_job(
+        self,
+        text: str,
+        headings: Sequence[Tuple[int, str, int]],
+        first_line: int,
+        source_path: Path,
+        properties: dict,
+        start: float,
+        piece: Tuple[int, int],
+        span: Optional[Tuple[int, int]],
+        strip_links: bool,
+    ):
+        # Lines of the headings are counted while the text is at hand, since
+        # lazy jobs release it
+        headings = list(iter_heading_lines(text, headings, first_line))
+
+        # Lazy jobs are planned in place of the text, which is then released
+        if self.lazy:
+            job = LoadText(source_path, span, strip_links, piece, headings)
+        else:
+            job = AddText(text, headings)
+
+        job.first_line = first_line
+        job.update_configs(properties)
+        job.source_path = source_path
+        self._add_job(job, start)
+
+    def load_text(self, job: LoadText, scanned_notes: Optional[LRUCache] = None) -> str:
+        # Reads and scans the note again, as when planned, and keeps the piece,
+        # notes split around embeds have many pieces, thus the scans are kept
+        # in the given cache, e.g.: for the length of a conversion
+        key = (job.file_path, job.span, job.strip_links)
+        scanned_note = scanned_notes.get(key) if scanned_notes is not None else MISSING
+
+        if scanned_note is MISSING:
+            scanned_note = self._load_scanned_note(job)
+
+            if scanned_notes is not None:
+                scanned_notes.put(key, scanned_note, size=len(scanned_note.text))
+
+        return scanned_note.text[job.piece[0] : job.piece[1]].strip()
+
+    def _load_scanned_note(self, job: LoadText) -> ScannedNote:
+        start = time.perf_counter()
+        file_contents = read_file(job.file_path, self.filesystem)
+
+        if job.span is not None:
+            file_contents = file_contents[job.span[0] : job.span[1]]
+
+        scanned_note = scan_note(file_contents, job.strip_links)
+
+        if self.hooks.enabled:
+            self.hooks.emit(
+                NOTE_RELOADED,
+                start,
+                time.perf_counter(),
+                path=job.file_path,
+                bytes=len(file_contents),
+            )
+
+        return scanned_note
+
+    def _add_embed(
+        self,
+        embed: Tuple[str, Optional[str], Optional[str]],
+        source_path: Path,
+        line: int,
+        properties: dict,
+        start: float,
+        strip_links: bool,
+        embed_ancestors: Tuple[Tuple[Path, Optional[str], Optional[str]], ...],
+    ):
+        note, heading, block_id = embed
+        note_path = self._resolve_embed(note, source_path.parent)
+
+        if note_path is None:
+            self._report(source_path, f"Embedded note {note} not found.", line)
+            return
+
+        key = (note_path, heading, block_id)
+
+        if key in embed_ancestors or len(embed_ancestors) >= MAX_EMBED_DEPTH:
+            self._report(
+                source_path, f"Embed of {note} creates a cycle, please check it.", line
+            )
+            return
+
+        index = self._note_index(note_path)
+
+        if heading is not None:
+            span = index.section(heading)
+        elif block_id is not None:
+            span = index.block(block_id)
+        else:
+            span = index.body
+
+        if span is None:
+            anchor = heading if heading is not None else f"^{block_id}"
+            self._report(source_path, f"{anchor} not found in {note_path}.", line)
+            return
+
+        # Only the embedded part of the note is scanned, links aren't followed
+        span_start, span_end, span_line = span
+        scanned_note = scan_note(index.text[span_start:span_end], strip_links)
+        self._citation_keys.update(scanned_note.citations)
+
+        self._add_text_jobs(
+            scanned_note,
+            note_path,
+            properties,
+            start,
+            strip_links,
+            span_line,
+            embed_ancestors + (key,),
+            (span_start, span_end),
+        )
 
     def add_citations(self, text: str):
         self._citation_keys.update(find_all_citations(text))
 
-    def add_file(self, file_path: Path):
-        assure_file(file_path)
+    def add_file(self, file_path: Path, stream: bool = False):
+        assure_file(file_path, self.filesystem)
 
-        # Read the file contents
-        file_contents = read_file(file_path)
-        self._n_files_read += 1
+        if stream:
+            return self._add_stream_file(file_path)
 
-        # Extract citations from the file
-        self.add_citations(file_contents)
+        # Read the file contents
+        start = time.perf_counter()
+        file_contents = self._read_note(file_path)
+
+        # Extract citations, headings and YAML properties in a single pass
+        scanned_note = scan_note(file_contents)
+        self._citation_keys.update(scanned_note.citations)
+        properties = parse_yaml_properties(
+            scanned_note.frontmatter, file_path, self.problems, self.cache_manager
+        )
+
+        # Single files have no deps, other than the notes they embed
+        self._embed_roots.append(file_path.parent)
+        self._add_text_jobs(scanned_note, file_path, properties, start, False)
+
+    def _add_stream_file(self, file_path: Path):
+        # Only the frontmatter is read while planning, the rest of the file
+        # is read line by line when the job is parsed
+        start = time.perf_counter()
+        frontmatter_lines, body_line = [], 0
+
+        for line_index, line in enumerate(iter_file_lines(file_path, self.filesystem)):
+            if line_index == 0:
+                if not line.startswith(FRONTMATTER_MARKER):
+                    break
+            elif line.startswith(FRONTMATTER_MARKER):
+                body_line = line_index + 1
+                break
+            else:
+                frontmatter_lines.append(line)
 
-        # If exist, parse the YAML properties
-        try:
-            file_contents, properties = parse_yaml_properties(file_contents)
-        except:
-            logging.error(
-                f"Error parsing YAML properties from {file_path}, ignoring..."
+        self._n_files_read += 1
+        self.read_paths.append(file_path)
+
+        if body_line > 0:
+            properties = parse_yaml_properties(
+                "\n".join(frontmatter_lines),
+                file_path,
+                self.problems,
+                self.cache_manager,
             )
+        else:
             properties = {}
 
-        # Single files have no deps
-        add_text_job = AddText(file_contents)
-        add_text_job.update_configs(properties)
+        stream_text_job = StreamText(file_path, body_line)
+        stream_text_job.update_configs(properties)
+        stream_text_job.source_path = file_path
+        stream_text_job.first_line = body_line
 
-        self._jobs.append(add_text_job)
+        self._add_job(stream_text_job, start)
+
+    def iter_stream_lines(
+        self, job: StreamText, citation_keys: Set[str]
+    ) -> Iterator[str]:
+        # Citations of streamed files are only known once the lines are read,
+        # thus are added to the keys of the conversion, not to the plan
+        start, n_bytes = time.perf_counter(), 0
+
+        lines = iter_file_lines(job.file_path, self.filesystem)
+
+        for line in islice(lines, job.body_line, None):
+            citation_keys.update(find_all_citations(line))
+            n_bytes += len(line) + 1
+            yield line
+
+        if self.hooks.enabled:
+            self.hooks.emit(
+                NOTE_READ, start, time.perf_counter(), path=job.file_path, bytes=n_bytes
+            )
 
     def add_dir(
         self,
@@ -128,77 +633,100 @@ class ExecutionPlan:
         max_depth: int = 10,
         base_hlevel: int = -2,
     ):
-        assure_dir(dir_path)
+        assure_dir(dir_path, self.filesystem)
 
         if index_file is None:
             index_file = "Index"
 
-        # Perform depth-first search to find all files
+        self._embed_roots.append(dir_path)
+
+        # Perform depth-first search to find all files, along with the notes
+        # that link to each one, to detect cycles
         # Base hlevel is -1 because index doesn't produce headers
-        stack = [(dir_path, index_file, base_hlevel - 1, 0)]
+        stack = [(dir_path, index_file, base_hlevel - 1, 0, ())]
         global_configs, is_index = {}, True
 
         while len(stack) > 0:
-            current_base_path, current_file, current_hlevel, current_depth = stack.pop()
+            (
+                current_base_path,
+                current_file,
+                current_hlevel,
+                current_depth,
+                ancestors,
+            ) = stack.pop()
 
             if current_depth < max_depth:
-                file_contents = read_file(current_base_path / f"{current_file}.md")
-                self._n_files_read += 1
-
-                # Each file can have properties configured in YAML
-                properties = {}
-
-                # Find all links are remove them from the text
-                clean_text, links = find_all_links(file_contents)
-
-                if clean_text != "":
-                    try:
-                        clean_text, properties = parse_yaml_properties(clean_text)
-                    except:
-                        logging.error(
-                            f"Error parsing YAML properties from {current_file}.md, ignoring..."
-                        )
-                        properties = {}
-
-                    if is_index:
-                        global_configs.update(properties)
+                start = time.perf_counter()
+                current_path = current_base_path / f"{current_file}.md"
+                file_contents = self._read_note(current_path)
+
+                # Find all links are remove them from the text, and parse
+                # the properties configured in YAML
+                scanned_note = scan_note(file_contents, strip_links=True)
+                clean_text, links = scanned_note.text, scanned_note.links
+                properties = parse_yaml_properties(
+                    scanned_note.frontmatter,
+                    current_path,
+                    self.problems,
+                    self.cache_manager,
+                )
 
-                if not is_index:
+                if is_index:
+                    global_configs.update(properties)
+                else:
                     properties.update(global_configs)
 
                 # If not the index file, add a header
                 if current_hlevel >= base_hlevel:
                     add_header_job = AddHeader(current_file, current_hlevel)
                     add_header_job.update_configs(properties)
+                    add_header_job.source_path = current_path
 
-                    self._jobs.append(add_header_job)
+                    self._add_job(add_header_job, start)
 
                 if clean_text != "":
-                    add_text_job = AddText(clean_text)
-                    add_text_job.update_configs(properties)
+                    self._citation_keys.update(scanned_note.citations)
+                    self._add_text_jobs(
+                        scanned_note, current_path, properties, start, True
+                    )
 
-                    self._jobs.append(add_text_job)
-                    self.add_citations(clean_text)
+                linked_ancestors = ancestors + (current_path,)
 
                 for link in reversed(links):
                     # Might be pointing to a file in the same folder
                     # or a subdirectory
                     new_base_path = current_base_path / link
 
-                    if not new_base_path.is_dir():
+                    if not self.filesystem.is_dir(new_base_path):
                         new_base_path = current_base_path
 
-                        if not (new_base_path / f"{link}.md").is_file():
-                            raise ValueError(
-                                f"File {link} not found in {new_base_path}"
+                        if not self.filesystem.is_file(new_base_path / f"{link}.md"):
+                            self._report(
+                                current_path,
+                                f"File {link} not found in {new_base_path}",
                             )
+                            continue
+
+                    if new_base_path / f"{link}.md" in linked_ancestors:
+                        self._report(
+                            current_path,
+                            f"Link to {link} creates a cycle, please check the links of {current_path}.",
+                        )
+                        continue
 
                     stack.append(
-                        (new_base_path, link, current_hlevel + 1, current_depth + 1)
+                        (
+                            new_base_path,
+                            link,
+                            current_hlevel + 1,
+                            current_depth + 1,
+                            linked_ancestors,
+                        )
                     )
             else:
-                raise ValueError(
-                    f"Max depth of {max_depth} reached, please check for cycles in your links."
+                self._report(
+                    current_base_path / f"{current_file}.md",
+                    f"Max depth of {max_depth} reached, please check for cycles in your links.",
                 )
 
             if is_index:
@@ -206,12 +734,78 @@ class ExecutionPlan:
 
         logging.info(f"Added {len(self._jobs)} jobs to the execution plan.")
 
+    async def prefetch_dir_async(
+        self,
+        dir_path: Path,
+        index_file: Optional[str] = None,
+        max_depth: int = 10,
+        executor: Optional[Executor] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENT_READS,
+    ):
+        # Reads the notes linked from the index concurrently, one level of
+        # links at a time, into the notes cache, so that planning the dir
+        # doesn't wait on each read in turn
+        if self.lazy:
+            return
+
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def prefetch(note_path: Path) -> List[Path]:
+            async with semaphore:
+                return await loop.run_in_executor(
+                    executor, self._prefetch_note, note_path
+                )
+
+        note_paths = [dir_path / f"{index_file or 'Index'}.md"]
+        prefetched_paths: Set[Path] = set()
+
+        for _ in range(max_depth):
+            note_paths = [
+                note_path
+                for note_path in dict.fromkeys(note_paths)
+                if note_path not in prefetched_paths
+            ]
+
+            if len(note_paths) == 0:
+                break
+
+            prefetched_paths.update(note_paths)
+            linked_paths = await asyncio.gather(*map(prefetch, note_paths))
+            note_paths = [path for paths in linked_paths for path in paths]
+
+    def _prefetch_note(self, note_path: Path) -> List[Path]:
+        # Returns the notes linked from the note, resolved as in add_dir, only
+        # notes that can be cached are read
+        if (
+            not self.filesystem.is_file(note_path)
+            or self.filesystem.mtime(note_path) is None
+        ):
+            return []
+
+        text = self._cached_note("notes", note_path, self._load_note)
+        linked_paths = []
+
+        for link in find_all_links(text)[1]:
+            base_path = note_path.parent / link
+
+            if not self.filesystem.is_dir(base_path):
+                base_path = note_path.parent
+
+            linked_paths.append(base_path / f"{link}.md")
+
+        return linked_paths
+
     def show(self, text_limit: int = 50, show_configs: bool = False):
         for order, job in enumerate(self._jobs, start=1):
             if isinstance(job, AddText):
                 if text_limit >= 0:
                     text_content = job.text[:text_limit]
                 logging.info(f"{order}. Adding text: {text_content}...")
+            elif isinstance(job, LoadText):
+                logging.info(f"{order}. Loading text from: {job.file_path}...")
+            elif isinstance(job, StreamText):
+                logging.info(f"{order}. Streaming text from: {job.file_path}...")
             elif isinstance(job, AddHeader):
                 logging.info(
                     f"{order}. Adding header: {job.header} with level {job.level}..."
@@ -231,29 +825,11 @@ class ExecutionPlan:
             if hlevel_zero_adjusted < 0:
                 hlevel_zero_adjusted = -hlevel_zero_adjusted
 
-            # Used for add text jobs to know the header level above
-            prev_header_level = 0
-            header_regex = r"(#+)\s*(.+)\s*\n"
-            tob_content = []
-
-            for job in self._jobs:
-                if isinstance(job, AddHeader):
-                    level = job.level + hlevel_zero_adjusted + 1
-                    title = job.header
-                    prev_header_level = level
-                    tob_content.append((level, title, job.configs))
-                elif isinstance(job, AddText):
-                    level = prev_header_level
-
-                    # Find all the headers contains inside
-                    headers_in_text = re.findall(header_regex, job.text)
-
-                    for header_level, header_title in headers_in_text:
-                        level = len(header_level) + prev_header_level
-                        tob_content.append((level, header_title, None))
-
-            for level, header, configs in tob_content:
-                if configs is not None and show_configs:
-                    logging.info(f"{' '*(level-1)}| {header} {configs}")
+            for entry in self.outline():
+                level = entry.level + hlevel_zero_adjusted + 1
+
+                # Headers of notes have no line, and show the note configs
+                if entry.line is None and show_configs:
+                    logging.info(f"{' '*(level-1)}| {entry.title} {entry.configs}")
                 else:
-                    logging.info(f"{' '*(level-1)}| {header}")
+                    logging.info(f"{' '*(level-1)}| {entry.title}")
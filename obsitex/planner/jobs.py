@@ -1,12 +1,16 @@
 from abc import ABC
 from pathlib import Path
-from typing import Set
+from typing import Optional, Sequence, Set, Tuple
 
 
 class PlannedJob(ABC):
     def __init__(self):
         self.configs = {}
 
+        # Note the job was planned from, and the line where its content starts
+        self.source_path: Optional[Path] = None
+        self.first_line = 0
+
     def update_configs(self, kwargs: dict):
         self.configs.update(kwargs)
 
@@ -14,15 +18,49 @@ class PlannedJob(ABC):
     def is_in_appendix(self) -> bool:
         return self.configs.get("appendix", False)
 
-    def mark_as_appendix(self):
-        self.configs["appendix"] = True
-
 
 class AddText(PlannedJob):
-    def __init__(self, text: str):
+    def __init__(self, text: str, headings: Sequence[Tuple[int, str, int, int]] = ()):
         super().__init__()
         self.text = text
 
+        # Headings found in the text as (level, title, offset, line), where the
+        # line is zero based in the note
+        self.headings = headings
+
+
+class LoadText(PlannedJob):
+    def __init__(
+        self,
+        file_path: Path,
+        span: Optional[Tuple[int, int]],
+        strip_links: bool,
+        piece: Tuple[int, int],
+        headings: Sequence[Tuple[int, str, int, int]] = (),
+    ):
+        super().__init__()
+        self.file_path = file_path
+
+        # Bounds of the embedded part of the note, None for the whole note
+        self.span = span
+
+        # Bounds of the text in the scanned span, before it's stripped
+        self.strip_links = strip_links
+        self.piece = piece
+
+        # Headings found in the text as (level, title, offset, line), where the
+        # line is zero based in the note
+        self.headings = headings
+
+
+class StreamText(PlannedJob):
+    def __init__(self, file_path: Path, body_line: int):
+        super().__init__()
+        self.file_path = file_path
+
+        # Index of the first line after the frontmatter
+        self.body_line = body_line
+
 
 class AddHeader(PlannedJob):
     def __init__(self, header: str, level: int):
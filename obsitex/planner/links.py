@@ -11,26 +11,34 @@ def find_all_citations(text: str) -> Set[Any]:
     return set(matches)
 
 
+def normalize_link(link: str) -> str:
+    # Aliased links point to the alias, paths point to the file name
+    if "|" in link:
+        return link.split("|")[1]
+    elif "/" in link:
+        return link.split("/")[-1]
+    else:
+        return link
+
+
 def find_all_links(text: str) -> Tuple[str, Sequence[str]]:
     link_regex = r"(?<!\!)\[\[(.*?)\]\]"
-    all_links = re.findall(link_regex, text)
+    resulting_links, pieces, piece_start = [], [], 0
+
+    for match in re.finditer(link_regex, text):
+        link = match.group(1)
 
-    # Filter out links starting with @, which are used for citations
-    all_links = [link for link in all_links if not link.startswith("@")]
-    resulting_links = []
+        # Filter out links starting with @, which are used for citations
+        if link.startswith("@"):
+            continue
 
-    for link in all_links:
-        if "|" in link:
-            resulting_links.append(link.split("|")[1])
-        elif "/" in link:
-            resulting_links.append(link.split("/")[-1])
-        else:
-            resulting_links.append(link)
+        resulting_links.append(normalize_link(link))
 
-    # Remove links from original text
-    for link in all_links:
-        text = text.replace(f"[[{link}]]", "")
+        # Remove links from original text
+        pieces.append(text[piece_start : match.start()])
+        piece_start = match.end()
 
-    text = text.strip()
+    pieces.append(text[piece_start:])
+    text = "".join(pieces).strip()
 
     return text, resulting_links
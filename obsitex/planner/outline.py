@@ -0,0 +1,141 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from obsitex.planner.jobs import AddHeader, AddText, LoadText, PlannedJob
+from obsitex.utils import section_label
+
+
+class OutlineEntry:
+    def __init__(
+        self,
+        level: int,
+        title: str,
+        source_path: Optional[Path],
+        line: Optional[int],
+        configs: dict,
+    ):
+        # Level as parsed, i.e.: the key of the section in the hlevel_mapping
+        self.level = level
+        self.title = title
+        self.label = section_label(title)
+
+        # Note and zero based line of the heading, None for the headers added
+        # for the notes of a folder, which come from the note name
+        self.source_path = source_path
+        self.line = line
+
+        # Configurations of the job the heading belongs to, not a copy
+        self.configs = configs
+
+        self.parent: Optional["OutlineEntry"] = None
+        self.children: List["OutlineEntry"] = []
+
+    def to_dict(self, include_configs: bool = False) -> dict:
+        entry = {
+            "level": self.level,
+            "title": self.title,
+            "label": self.label,
+            "source": str(self.source_path) if self.source_path is not None else None,
+            "line": self.line,
+        }
+
+        if include_configs:
+            entry["configs"] = self.configs
+
+        entry["children"] = [child.to_dict(include_configs) for child in self.children]
+
+        return entry
+
+    def __repr__(self):
+        return f'OutlineEntry(level={self.level}, title="{self.title}")'
+
+
+class Outline:
+    # Headings of a document in order, as a tree, indexed by label and note
+    def __init__(self):
+        self.entries: List[OutlineEntry] = []
+        self.roots: List[OutlineEntry] = []
+        self._by_label: Dict[str, List[OutlineEntry]] = {}
+        self._by_note: Dict[Path, List[OutlineEntry]] = {}
+
+        # Entries that may still be the parent of the next one
+        self._open_entries: List[OutlineEntry] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[OutlineEntry]:
+        return iter(self.entries)
+
+    def add(self, entry: OutlineEntry):
+        while (
+            len(self._open_entries) > 0 and self._open_entries[-1].level >= entry.level
+        ):
+            self._open_entries.pop()
+
+        if len(self._open_entries) > 0:
+            entry.parent = self._open_entries[-1]
+            entry.parent.children.append(entry)
+        else:
+            self.roots.append(entry)
+
+        self._open_entries.append(entry)
+        self.entries.append(entry)
+        self._by_label.setdefault(entry.label, []).append(entry)
+
+        if entry.source_path is not None:
+            self._by_note.setdefault(entry.source_path, []).append(entry)
+
+    def by_label(self, label: str) -> List[OutlineEntry]:
+        # More than one entry means the label is ambiguous in LaTeX
+        return self._by_label.get(label, [])
+
+    def by_note(self, note_path: Path) -> List[OutlineEntry]:
+        return self._by_note.get(note_path, [])
+
+    def duplicate_labels(self) -> Dict[str, List[OutlineEntry]]:
+        return {
+            label: entries
+            for label, entries in self._by_label.items()
+            if len(entries) > 1
+        }
+
+    def to_dict(self, include_configs: bool = False) -> List[dict]:
+        return [root.to_dict(include_configs) for root in self.roots]
+
+    def to_json(self, include_configs: bool = False, indent: int = 2) -> str:
+        # Configurations may have values that aren't JSON, e.g.: dates
+        return json.dumps(self.to_dict(include_configs), indent=indent, default=str)
+
+    def write(self, path: Path, include_configs: bool = False):
+        with open(path, "w") as file:
+            file.write(self.to_json(include_configs))
+
+
+def build_outline(jobs: Sequence[PlannedJob], initial_hlevel: int) -> Outline:
+    # Headings in the text are offset by the level of the latest header, as
+    # done by the parser, streamed files aren't included since their headings
+    # are only known when parsed
+    outline = Outline()
+    latest_hlevel = initial_hlevel
+
+    for job in jobs:
+        if isinstance(job, AddHeader):
+            latest_hlevel = job.level
+            outline.add(
+                OutlineEntry(job.level, job.header, job.source_path, None, job.configs)
+            )
+        elif isinstance(job, (AddText, LoadText)):
+            for level, title, _, line in job.headings:
+                outline.add(
+                    OutlineEntry(
+                        level + latest_hlevel,
+                        title,
+                        job.source_path,
+                        line,
+                        job.configs,
+                    )
+                )
+
+    return outline
@@ -0,0 +1,163 @@
+import re
+from typing import List, Optional, Set, Tuple
+
+from obsitex.planner.links import normalize_link
+
+# Matches, in a single pass, the tokens the planner cares about: code fences and
+# headings at the start of a line, and wikilinks or embeds anywhere in the text
+NOTE_TOKEN_REGEX = re.compile(
+    r"^(?P<fence>```)" r"|^(?P<hashes>#+)" r"|(?P<embed>!)?\[\[(?P<target>.*?)\]\]",
+    re.MULTILINE,
+)
+
+FRONTMATTER_MARKER = "---"
+LEADING_WHITESPACE_REGEX = re.compile(r"\s*")
+
+
+class ScannedNote:
+    def __init__(
+        self,
+        text: str,
+        frontmatter: Optional[str],
+        links: List[str],
+        embeds: List[str],
+        citations: Set[str],
+        headings: List[Tuple[int, str, int]],
+        first_line: int = 0,
+    ):
+        # Text of the note without frontmatter, and without links if stripped
+        self.text = text
+
+        # Raw YAML contents of the frontmatter, None if the note has none
+        self.frontmatter = frontmatter
+
+        # Targets of the links and embeds, in the order they appear
+        self.links = links
+        self.embeds = embeds
+
+        # Keys of all citations, i.e.: [[@key]]
+        self.citations = citations
+
+        # Headings as (level, title, offset), offset is relative to the text
+        self.headings = headings
+
+        # Line of the note where the text starts
+        self.first_line = first_line
+
+
+def find_frontmatter_bounds(text: str) -> Optional[Tuple[int, int]]:
+    # Frontmatter must be the first thing in the note, returns the bounds of its
+    # contents, excluding the markers
+    start = LEADING_WHITESPACE_REGEX.match(text).end()
+
+    if not text.startswith(FRONTMATTER_MARKER, start):
+        return None
+
+    end = text.find(FRONTMATTER_MARKER, start + len(FRONTMATTER_MARKER))
+
+    if end == -1:
+        return None
+
+    return start + len(FRONTMATTER_MARKER), end
+
+
+def scan_frontmatter_links(
+    frontmatter: str, strip_links: bool = False
+) -> Tuple[str, List[str]]:
+    # Links in the properties, e.g.: related: "[[Note]]", are followed as
+    # those in the text, but lines starting with # are YAML comments
+    links, pieces, piece_start = [], [], 0
+
+    for match in NOTE_TOKEN_REGEX.finditer(frontmatter):
+        target = match.group("target")
+
+        if target is None or target.startswith("@") or match.group("embed"):
+            continue
+
+        links.append(normalize_link(target))
+
+        if strip_links:
+            pieces.append(frontmatter[piece_start : match.start()])
+            piece_start = match.end()
+
+    pieces.append(frontmatter[piece_start:])
+
+    return "".join(pieces), links
+
+
+def scan_note(text: str, strip_links: bool = False) -> ScannedNote:
+    frontmatter_bounds = find_frontmatter_bounds(text)
+
+    if frontmatter_bounds is not None:
+        frontmatter, links = scan_frontmatter_links(
+            text[frontmatter_bounds[0] : frontmatter_bounds[1]], strip_links
+        )
+        body_start = frontmatter_bounds[1] + len(FRONTMATTER_MARKER)
+    else:
+        frontmatter, links = None, []
+        body_start = 0
+
+    embeds, citations, headings = [], set(), []
+
+    # Pieces of the clean text, only split where links are removed
+    pieces: List[str] = []
+    piece_start, clean_length = body_start, 0
+    in_fence = False
+
+    for match in NOTE_TOKEN_REGEX.finditer(text, body_start):
+        if match.group("fence") is not None:
+            in_fence = not in_fence
+        elif match.group("hashes") is not None:
+            # Comments in code blocks aren't headings
+            if not in_fence:
+                offset = clean_length + match.start() - piece_start
+                headings.append((len(match.group("hashes")), offset))
+        else:
+            target = match.group("target")
+
+            if target.startswith("@"):
+                if "]" not in target:
+                    citations.add(target[1:])
+            elif match.group("embed") is not None:
+                embeds.append(target)
+            else:
+                links.append(normalize_link(target))
+
+                if strip_links:
+                    pieces.append(text[piece_start : match.start()])
+                    clean_length += match.start() - piece_start
+                    piece_start = match.end()
+
+    pieces.append(text[piece_start:])
+    clean_text = "".join(pieces)
+
+    # Headings offsets must account for the removed leading whitespace
+    leading_whitespace = LEADING_WHITESPACE_REGEX.match(clean_text).end()
+    first_line = text.count("\n", 0, body_start) + clean_text.count(
+        "\n", 0, leading_whitespace
+    )
+    clean_text = clean_text.strip()
+    scanned_headings = []
+
+    for level, offset in headings:
+        offset -= leading_whitespace
+        end_of_line = clean_text.find("\n", offset)
+
+        if end_of_line == -1:
+            end_of_line = len(clean_text)
+
+        # Titles are taken from the clean text, since they might contain links
+        title = clean_text[offset + level : end_of_line].strip()
+
+        if title != "":
+            scanned_headings.append((level, title, offset))
+
+    return ScannedNote(
+        clean_text,
+        frontmatter,
+        links,
+        embeds,
+        citations,
+        scanned_headings,
+        first_line,
+    )
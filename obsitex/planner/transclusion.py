@@ -0,0 +1,156 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from obsitex.planner.scanner import FRONTMATTER_MARKER, find_frontmatter_bounds
+
+# Embeds alone in their line, e.g.: ![[Note#Section]], code fences are matched
+# to skip the embeds inside code blocks
+EMBED_LINE_REGEX = re.compile(
+    r"^(?P<fence>```)|^[ \t]*!\[\[(?P<target>[^\]]+)\]\][ \t]*$", re.MULTILINE
+)
+
+# Embeds of files with an extension other than .md aren't notes, e.g.: images
+ATTACHMENT_REGEX = re.compile(r"\.(?!md$)[A-Za-z0-9]{1,5}$", re.IGNORECASE)
+
+HEADING_LINE_REGEX = re.compile(r"(#+)[ \t]+(.*?)[ \t]*$")
+BLOCK_ID_REGEX = re.compile(r"(?:^|[ \t])\^([A-Za-z0-9-]+)[ \t]*$")
+
+# Maximum depth of embeds inside embedded notes
+MAX_EMBED_DEPTH = 10
+
+# Bounds of a part of a note, as (start, end, line), where start and end are
+# offsets in the note and line is the zero based line of the start
+NoteSpan = Tuple[int, int, int]
+
+
+def parse_embed_target(
+    target: str,
+) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+    # Returns the note, heading and block id of the embed, None if the embed
+    # isn't of a note
+    note, _, anchor = target.split("|")[0].strip().partition("#")
+
+    if ATTACHMENT_REGEX.search(note) is not None:
+        return None
+
+    if note.lower().endswith(".md"):
+        note = note[: -len(".md")]
+
+    if anchor.startswith("^"):
+        return note, None, anchor[1:].strip()
+    elif anchor != "":
+        # Nested headings, e.g.: Note#Chapter#Section, point to the last one
+        return note, anchor.split("#")[-1].strip(), None
+
+    return note, None, None
+
+
+class NoteIndex:
+    # Offsets of the headings and block ids of a note, built in a single pass
+    # so that embedding a part of the note is a slice of its text
+    def __init__(self, text: str):
+        self.text = text
+
+        frontmatter_bounds = find_frontmatter_bounds(text)
+
+        if frontmatter_bounds is not None:
+            body_start = frontmatter_bounds[1] + len(FRONTMATTER_MARKER)
+        else:
+            body_start = 0
+
+        self.body: NoteSpan = (body_start, len(text), text.count("\n", 0, body_start))
+        self.sections: Dict[str, NoteSpan] = {}
+        self.blocks: Dict[str, NoteSpan] = {}
+        self._build_index()
+
+    def _build_index(self):
+        text = self.text
+        offset, end_of_text, line = self.body[0], len(text), self.body[2]
+
+        # Headings whose section is still open, as (level, title, start, line)
+        open_headings: List[Tuple[int, str, int, int]] = []
+
+        # Current run of non blank lines, and the latest one, used by block ids
+        paragraph: Optional[Tuple[int, int]] = None
+        previous_paragraph: Optional[NoteSpan] = None
+        in_fence = False
+
+        while offset < end_of_text:
+            end_of_line = text.find("\n", offset)
+
+            if end_of_line == -1:
+                end_of_line = end_of_text
+
+            content = text[offset:end_of_line]
+            heading_match = None
+            block_match = None
+
+            if content.startswith("```"):
+                in_fence = not in_fence
+            elif not in_fence:
+                heading_match = HEADING_LINE_REGEX.match(content)
+                block_match = BLOCK_ID_REGEX.search(content)
+
+            if heading_match is not None:
+                # A heading closes the sections of the same or deeper levels
+                level = len(heading_match.group(1))
+
+                while len(open_headings) > 0 and open_headings[-1][0] >= level:
+                    self._close_section(open_headings.pop(), offset)
+
+                open_headings.append((level, heading_match.group(2), offset, line))
+
+                if paragraph is not None:
+                    previous_paragraph = (paragraph[0], offset, paragraph[1])
+
+                paragraph = None
+            elif block_match is not None:
+                if content[: block_match.start()].strip() == "":
+                    # Block ids in their own line point to the block above
+                    if paragraph is not None:
+                        block = (paragraph[0], offset, paragraph[1])
+                    else:
+                        block = previous_paragraph
+                else:
+                    if paragraph is None:
+                        paragraph = (offset, line)
+
+                    block = (paragraph[0], offset + block_match.start(), paragraph[1])
+
+                if block is not None:
+                    self.blocks.setdefault(block_match.group(1), block)
+
+                previous_paragraph, paragraph = block, None
+            elif content.strip() == "":
+                if paragraph is not None:
+                    previous_paragraph = (paragraph[0], offset, paragraph[1])
+
+                paragraph = None
+            elif paragraph is None:
+                paragraph = (offset, line)
+
+            offset, line = end_of_line + 1, line + 1
+
+        while len(open_headings) > 0:
+            self._close_section(open_headings.pop(), end_of_text)
+
+    def _close_section(self, heading: Tuple[int, str, int, int], end: int):
+        # Sections are closed out of order, the first heading with a title wins
+        _, title, start, line = heading
+
+        if title not in self.sections or self.sections[title][0] > start:
+            self.sections[title] = (start, end, line)
+
+    def section(self, heading: str) -> Optional[NoteSpan]:
+        if heading in self.sections:
+            return self.sections[heading]
+
+        # Obsidian matches headings regardless of case
+        for title, span in self.sections.items():
+            if title.lower() == heading.lower():
+                return span
+
+        return None
+
+    def block(self, block_id: str) -> Optional[NoteSpan]:
+        return self.blocks.get(block_id, None)
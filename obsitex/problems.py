@@ -0,0 +1,23 @@
+from pathlib import Path
+from typing import Optional
+
+
+class Problem:
+    def __init__(self, path: Optional[Path], line: Optional[int], message: str):
+        # Note and line where the problem was found, lines are zero based
+        self.path = path
+        self.line = line
+        self.message = message
+
+    @property
+    def location(self) -> str:
+        if self.line is None:
+            return str(self.path)
+
+        return f"{self.path}:{self.line + 1}"
+
+    def __str__(self):
+        return f"{self.location}: {self.message}"
+
+    def __repr__(self):
+        return f'Problem(location="{self.location}", message="{self.message}")'
@@ -0,0 +1,85 @@
+from pathlib import Path
+from typing import List, Optional
+
+import yaml
+
+from obsitex.constants import DEFAULT_JINJA2_MAIN_TEMPLATE
+
+
+class OutputTarget:
+    # One output of a conversion, all targets share the same planning and
+    # parsing, only the main template and the header levels differ
+    def __init__(
+        self,
+        out_path: Path,
+        main_template: str = DEFAULT_JINJA2_MAIN_TEMPLATE,
+        hlevel_mapping: Optional[dict] = None,
+        template_path: Optional[Path] = None,
+    ):
+        self.out_path = out_path
+        self.main_template = main_template
+
+        # If not given, the mapping of the parser is used
+        self.hlevel_mapping = hlevel_mapping
+
+        # File the template was read from, if any, e.g.: for manifests
+        self.template_path = template_path
+
+    @property
+    def extra_args(self) -> dict:
+        # Arguments of the blocks that are overridden by this target
+        if self.hlevel_mapping is None:
+            return {}
+
+        return {"hlevel_mapping": self.hlevel_mapping}
+
+    def __repr__(self):
+        return f"OutputTarget({self.out_path})"
+
+
+def load_targets(targets_path: Path) -> List[OutputTarget]:
+    # Targets are a YAML list, paths are relative to the targets file, e.g.:
+    # - main-tex: output/thesis.tex
+    #   template: thesis.tex
+    #   hlevel-mapping: {-1: chapter, 0: section}
+    with open(targets_path, "r") as file:
+        targets_config = yaml.safe_load(file)
+
+    if not isinstance(targets_config, list) or len(targets_config) == 0:
+        raise ValueError(f"Targets in {targets_path} must be a non empty list.")
+
+    base_path = targets_path.parent
+    targets = []
+
+    for target_config in targets_config:
+        if not isinstance(target_config, dict) or "main-tex" not in target_config:
+            raise ValueError(
+                f"Each target in {targets_path} must define its main-tex, got {target_config}"
+            )
+
+        hlevel_mapping = target_config.get("hlevel-mapping", None)
+
+        if hlevel_mapping is not None and not isinstance(hlevel_mapping, dict):
+            raise ValueError(
+                f"The hlevel-mapping of {target_config['main-tex']} must map levels to LaTeX commands."
+            )
+
+        if target_config.get("template", None) is not None:
+            template_path = base_path / target_config["template"]
+
+            with open(template_path, "r") as file:
+                main_template = file.read()
+        else:
+            template_path = None
+            main_template = DEFAULT_JINJA2_MAIN_TEMPLATE
+
+        targets.append(
+            OutputTarget(
+                base_path / target_config["main-tex"],
+                main_template=main_template,
+                hlevel_mapping=hlevel_mapping,
+                template_path=template_path,
+            )
+        )
+
+    return targets
@@ -1,19 +1,74 @@
+import re
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterator, Optional, Tuple
 
+from obsitex.constants import SPLIT_INDEX_FILE
+from obsitex.filesystem import LOCAL_FILESYSTEM, FileSystem
 
-def assure_dir(path: Optional[Path]):
-    if path is not None and not path.is_dir():
+
+def assure_dir(path: Optional[Path], filesystem: FileSystem = LOCAL_FILESYSTEM):
+    if path is not None and not filesystem.is_dir(path):
         raise ValueError(f"Path {path} is not a directory.")
 
 
-def assure_file(path: Optional[Path]):
-    if path is not None and not path.is_file():
+def assure_file(path: Optional[Path], filesystem: FileSystem = LOCAL_FILESYSTEM):
+    if path is not None and not filesystem.is_file(path):
         raise ValueError(f"Path {path} is not a file.")
 
 
-def read_file(file_path: Path) -> str:
-    assure_file(file_path)
+def read_file(file_path: Path, filesystem: FileSystem = LOCAL_FILESYSTEM) -> str:
+    assure_file(file_path, filesystem)
+    return filesystem.read_text(file_path)
+
+
+def iter_file_lines(
+    file_path: Path, filesystem: FileSystem = LOCAL_FILESYSTEM
+) -> Iterator[str]:
+    assure_file(file_path, filesystem)
+
+    # Lines are read lazily, without the trailing newline
+    with filesystem.open_text(file_path) as file:
+        for line in file:
+            yield line.rstrip("\n")
+
+
+def write_if_changed(file_path: Path, content: str) -> bool:
+    # Only touch the file if the contents differ, this preserves the mtime
+    # of unchanged outputs so that latexmk can skip them
+    if file_path.is_file() and read_file(file_path) == content:
+        return False
+
+    with open(file_path, "w") as file:
+        file.write(content)
+
+    return True
+
+
+def write_split_files(folder: Path, files: Dict[str, str]) -> Tuple[int, int]:
+    # Writes each file as NAME.tex, only if changed, and removes the files
+    # written by a previous run that are no longer produced, files that
+    # weren't written by obsitex are left untouched
+    index_path = folder / SPLIT_INDEX_FILE
+    folder.mkdir(parents=True, exist_ok=True)
+
+    n_updated = sum(
+        write_if_changed(folder / f"{name}.tex", content)
+        for name, content in files.items()
+    )
+    n_removed = 0
+
+    if index_path.is_file():
+        for name in read_file(index_path).splitlines():
+            if name not in files and (folder / f"{name}.tex").is_file():
+                (folder / f"{name}.tex").unlink()
+                n_removed += 1
+
+    write_if_changed(index_path, "".join(f"{name}\n" for name in files))
+
+    return n_updated, n_removed
+
 
-    with open(file_path, "r") as file:
-        return file.read()
+def section_label(title: str) -> str:
+    # Label of the LaTeX section of a heading, e.g.: for references
+    reformatted_title = re.sub(r"\W", "_", title)
+    return f"sec:{reformatted_title}"